@@ -1,14 +1,1842 @@
 #!/usr/bin/env python3
 import math as mt
 import os
+import argparse
+import gzip
+import json
+import hashlib
 import itertools
 import collections
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
+import contextlib
+import functools
+import logging
+import time
+import concurrent.futures
 import numpy as np
-import scipy.stats
-import seaborn as sns
-from Bio import SeqIO
+import scipy.sparse
+
+
+
+def encode_sequence(seq, alphabet="ATCG"):
+    """It converts a genetic sequence into a NumPy array of integer
+    codes: each letter gets its position in the alphabet (0, 1, 2, 3
+    for "ATCG"), any other symbol (N, gaps, lower-case letters...)
+    gets the code 255 and it is masked out during the words extraction.
+
+    Parameters
+    ----------
+    seq: 'str', 'bytes', 'Bio.Seq' or 'PackedSequence'
+    The genetic sequence.
+    alphabet: 'str'
+    The genetic alphabet.
+
+    """
+    if isinstance(seq, PackedSequence) and seq.alphabet == alphabet:
+        return seq.codes()
+    lookup = np.full(256, 255, dtype=np.uint8)
+    for code, letter in enumerate(alphabet):
+        lookup[ord(letter)] = code
+    if not isinstance(seq, bytes):
+        seq = str(seq).encode("ascii", "replace")
+    return lookup[np.frombuffer(seq, dtype=np.uint8)]
+
+
+class PackedSequence():
+
+    """A genetic sequence stored with 2 bits per base (4 bases per byte)
+    in a NumPy buffer. The positions holding a symbol out of the alphabet
+    (N, gaps...) are kept apart as a mask of intervals, so that they are
+    still excluded from the words extraction. It behaves as a read-only
+    string for len() and slicing.
+
+    """
+
+    def __init__(self, packed, length, mask_starts, mask_ends, alphabet="ATCG"):
+        self.packed = packed
+        self.length = length
+        self.mask_starts = mask_starts
+        self.mask_ends = mask_ends
+        self.alphabet = alphabet
+
+    @classmethod
+    def from_chunks(cls, chunks, alphabet="ATCG"):
+        """It packs a sequence given as an iterable of code arrays
+        (see encode_sequence), without concatenating them."""
+        packed = []
+        starts = []
+        ends = []
+        carry = np.empty(0, dtype=np.uint8)
+        length = 0
+        for codes in chunks:
+            invalid = np.diff(np.concatenate(([0], (codes >= len(alphabet)).view(np.int8), [0])))
+            starts.append(np.flatnonzero(invalid == 1) + length)
+            ends.append(np.flatnonzero(invalid == -1) + length)
+            length += len(codes)
+            codes = np.concatenate((carry, np.where(codes < len(alphabet), codes, 0)))
+            full = len(codes) - len(codes) % 4
+            packed.append(cls.pack(codes[:full]))
+            carry = codes[full:]
+        packed.append(cls.pack(np.concatenate((carry, np.zeros(-len(carry) % 4, dtype=np.uint8)))))
+        starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+        ends = np.concatenate(ends) if ends else np.empty(0, dtype=np.int64)
+        #intervals split across two chunks are merged
+        join = np.isin(starts, ends)
+        return cls(np.concatenate(packed), length, starts[~join],
+                   ends[~np.isin(ends, starts)], alphabet)
+
+    @classmethod
+    def from_codes(cls, codes, alphabet="ATCG"):
+        return cls.from_chunks([codes], alphabet)
+
+    @staticmethod
+    def pack(codes):
+        codes = codes.reshape(-1, 4)
+        return (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3]
+
+    def codes(self, start=0, end=None):
+        """It returns the codes of the bases in [start, end), the masked
+        positions getting 255 as in encode_sequence."""
+        if end is None or end > self.length:
+            end = self.length
+        start = min(max(start, 0), end)
+        chunk = self.packed[start // 4:(end + 3) // 4]
+        codes = np.empty((len(chunk), 4), dtype=np.uint8)
+        for shift in range(0, 4):
+            codes[:, shift] = (chunk >> (6 - 2*shift)) & 3
+        codes = codes.ravel()[start % 4:start % 4 + end - start]
+        first = np.searchsorted(self.mask_ends, start, side="right")
+        last = np.searchsorted(self.mask_starts, end, side="left")
+        for mask_start, mask_end in zip(self.mask_starts[first:last], self.mask_ends[first:last]):
+            codes[max(mask_start, start) - start:min(mask_end, end) - start] = 255
+        return codes
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step not in (None, 1):
+            raise TypeError("PackedSequence only supports contiguous slices")
+        start, end, step = item.indices(self.length)
+        return PackedSequence.from_codes(self.codes(start, max(start, end)), self.alphabet)
+
+    def __str__(self):
+        letters = np.frombuffer((self.alphabet + "N").encode("ascii"), dtype=np.uint8)
+        codes = self.codes()
+        return letters[np.minimum(codes, len(self.alphabet))].tobytes().decode("ascii")
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes + self.mask_starts.nbytes + self.mask_ends.nbytes
+
+
+FASTA_EXTENSIONS = (".fasta", ".fa", ".fna", ".fas")
+GENBANK_EXTENSIONS = (".gb", ".gbk")
+
+
+def open_sequence_file(path):
+    """It opens a (possibly gzip-compressed) file in binary mode."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def sequence_format(name):
+    """It returns "fasta", "genbank" or None from a file name."""
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(FASTA_EXTENSIONS):
+        return "fasta"
+    if name.endswith(GENBANK_EXTENSIONS):
+        return "genbank"
+    return None
+
+
+def strip_extension(name):
+    """It removes the sequence file extension (and .gz) from a name."""
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for ext in FASTA_EXTENSIONS + GENBANK_EXTENSIONS:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+def fasta_records(path, alphabet="ATCG", chunk_size=2**20):
+    """It streams the records of a (multi-)FASTA file, plain or gzip.
+    It yields (record id, chunks) where chunks is an iterator over the
+    encoded sequence (see encode_sequence): the file is read by at most
+    chunk_size bytes at a time (even a sequence on a single line), which
+    are upper-cased and encoded in chunks of about chunk_size bases, so
+    the text of a whole sequence is never held in memory. The chunks of a
+    record must be consumed before moving to the next record.
+
+    """
+    def header_name(handle, piece):
+        header = piece[1:]
+        while piece and not piece.endswith(b"\n"):  #the rest of a long header
+            piece = handle.readline(chunk_size)
+            words = header.lstrip()
+            if not words or words.split(None, 1)[0] == words:  #kept until the end of the id
+                header += piece
+        return header.split()[0].decode() if header.split() else ""
+
+    def chunks(handle):
+        buffer = []
+        size = 0
+        piece, start = handle.readline(chunk_size), True
+        #a ">" only starts a record at the start of a line
+        while piece and not (start and piece.startswith(b">")):
+            bases = piece.strip()
+            buffer.append(bases)
+            size += len(bases)
+            if size >= chunk_size:
+                yield encode_sequence(b"".join(buffer).upper(), alphabet)
+                buffer = []
+                size = 0
+            piece, start = handle.readline(chunk_size), piece.endswith(b"\n")
+        if buffer:
+            yield encode_sequence(b"".join(buffer).upper(), alphabet)
+        state["next"] = piece
+
+    state = {}
+    with open_sequence_file(path) as handle:
+        piece, start = handle.readline(chunk_size), True
+        while piece and not (start and piece.startswith(b">")):
+            piece, start = handle.readline(chunk_size), piece.endswith(b"\n")
+        while piece:
+            name = header_name(handle, piece)
+            yield name, chunks(handle)
+            piece = state["next"]
+
+
+def read_fasta(path, alphabet="ATCG", chunk_size=2**20):
+    """It streams the records of a (multi-)FASTA file, plain or gzip,
+    and yields (record id, PackedSequence) (see fasta_records).
+
+    """
+    for name, chunks in fasta_records(path, alphabet, chunk_size):
+        yield name, PackedSequence.from_chunks(chunks, alphabet)
+
+
+def record_name(fil, rec_id, records):
+    """The name in files of the record rec_id of the file fil, which
+    contains records sequences."""
+    if records == 1:
+        return fil
+    ext = fil[len(strip_extension(fil)):]
+    return "{}_{}{}".format(strip_extension(fil), rec_id, ext)
+
+
+def read_genbank(path, alphabet="ATCG"):
+    """It streams the records of a (multi-record, plain or gzip) GenBank
+    file with a single parse. It yields (record id, PackedSequence) with
+    the region of the first "source" feature of each record.
+
+    WARNING: depending on which and how many features one has to
+    extract from *.gb files, the code must be changed accordingly.
+
+    """
+    from Bio import SeqIO
+    with gzip.open(path, "rt") if path.endswith(".gz") else open(path) as handle:
+        for rec in SeqIO.parse(handle, "genbank"):
+            for ff in rec.features:
+                if ff.type == "source":  #this line select the genbank feature
+                    seq = bytes(ff.location.extract(rec).seq).upper()
+                    yield rec.id, PackedSequence.from_codes(encode_sequence(seq, alphabet), alphabet)
+                    break   #in a *.gb file features can repeat (more studies on same region)
+
+
+CANONICAL_WORDS = {}
+
+
+def reverse_complement_indices(indices, k):
+    """It returns the indices of the reverse complements of words of
+    length k given by their indices (positions in all_w). With the
+    alphabet "ATCG" the complement of a letter code is code ^ 1
+    (A <-> T, C <-> G), so the reverse complement is computed on the
+    integers, reading the base-4 digits backwards.
+
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    reverse = np.zeros_like(indices)
+    for pos in range(0, k):
+        reverse = reverse * 4 + (((indices >> (2*pos)) & 3) ^ 1)
+    return reverse
+
+
+def canonical_words(k):
+    """It returns the sorted indices of the canonical words of length k,
+    i.e. the words not greater than their reverse complement. They are
+    the columns of the profiles in canonical mode (see kmer_indices).
+
+    """
+    if k not in CANONICAL_WORDS:
+        indices = np.arange(4**k, dtype=np.int64)
+        CANONICAL_WORDS[k] = indices[indices <= reverse_complement_indices(indices, k)]
+    return CANONICAL_WORDS[k]
+
+
+def profile_width(k, base=4, canonical=False):
+    """It returns the length of the profiles: base**k or, in canonical
+    mode, the number of canonical words (4**k / 2 plus half the
+    palindromes for even k)."""
+    if canonical:
+        return (4**k + (4**(k // 2) if k % 2 == 0 else 0)) // 2
+    return base**k
+
+
+def kmer_indices(codes, k, base=4, positions=False, canonical=False):
+    """It returns the indices of all the words of length k in an encoded
+    sequence (see encode_sequence). The index of a word is its position
+    in all_w, i.e. the word read as a number in base len(alphabet):
+    it is computed with a rolling (Horner) hash over the k reading
+    frames at once. The windows containing a symbol out of the alphabet
+    are discarded. If positions, the start positions of the words are
+    returned as well.
+
+    If canonical (alphabet "ATCG" only), each word is collapsed with its
+    reverse complement, whose index is rolled at the same time: the
+    index returned is the position of the smaller of the two in
+    canonical_words(k), so both strands give the same profile.
+
+    """
+    if canonical and base != 4:
+        raise ValueError("canonical words need the 4-letter alphabet 'ATCG'")
+    end_pos = len(codes) - k + 1
+    if end_pos <= 0:
+        if positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.empty(0, dtype=np.int64)
+    invalid = codes >= base
+    clean = np.where(invalid, 0, codes).astype(np.int64)
+    indices = np.zeros(end_pos, dtype=np.int64)
+    for pos in range(0, k):
+        indices *= base
+        indices += clean[pos:pos+end_pos]
+    if canonical:
+        reverse = np.zeros(end_pos, dtype=np.int64)
+        for pos in range(0, k):
+            reverse += (clean[pos:pos+end_pos] ^ 1) << (2*pos)
+        indices = np.searchsorted(canonical_words(k), np.minimum(indices, reverse))
+    bad = np.concatenate(([0], np.cumsum(invalid, dtype=np.int64)))
+    valid = bad[k:] == bad[:end_pos]
+    if positions:
+        return indices[valid], np.flatnonzero(valid)
+    return indices[valid]
+
+
+def window_profiles(codes, k, window, stride=None, base=4, canonical=False):
+    """It returns the words' occurrences of the windows of an encoded
+    sequence as a scipy.sparse CSR matrix (one row per window, columns
+    sorted as all_w). The windows are [j*stride, j*stride + window) for
+    all the windows inside the sequence, so they overlap if
+    stride < window. A word belongs to a window if it starts in it: with
+    stride == window every word is counted exactly once, including the
+    ones across the edges of two windows.
+
+    The word indices are computed once for the whole sequence; the
+    sequence is cut into segments at every window edge and each window
+    profile is the sum of the counts of its segments. The columns are
+    the canonical words if canonical (see kmer_indices).
+
+    """
+    if stride is None:
+        stride = window
+    width = profile_width(k, base, canonical)
+    n_windows = (len(codes) - window) // stride + 1 if len(codes) >= window else 0
+    starts = np.arange(n_windows, dtype=np.int64) * stride
+    edges = np.unique(np.concatenate((starts, starts + window)))
+    indices, pos = kmer_indices(codes, k, base, positions=True, canonical=canonical)
+    if n_windows == 0:
+        return scipy.sparse.csr_matrix((0, width), dtype=np.int64)
+    inside = (pos >= edges[0]) & (pos < edges[-1])
+    segment = np.searchsorted(edges, pos[inside], side="right") - 1
+    segments = scipy.sparse.csr_matrix(
+        (np.ones(len(segment), dtype=np.int64), (segment, indices[inside])),
+        shape=(len(edges) - 1, width))
+    first = np.searchsorted(edges, starts)
+    last = np.searchsorted(edges, starts + window)
+    covering = scipy.sparse.csr_matrix(
+        (np.ones(int((last - first).sum()), dtype=np.int64),
+         np.concatenate([np.arange(f, l) for f, l in zip(first, last)]),
+         np.concatenate(([0], np.cumsum(last - first)))),
+        shape=(n_windows, len(edges) - 1))
+    return scipy.sparse.csr_matrix(covering @ segments)
+
+
+def kmer_richness(codes, max_k, base=4, canonical=False):
+    """It returns the richness curve of an encoded sequence, i.e. the
+    number of distinct words appearing at least twice, for every
+    k in 1, ..., max_k - 1. The curve is computed in a single pass:
+    the indices (and the validity mask) of the words of length k + 1
+    are derived from the ones of length k, appending the next letter.
+    If canonical, a word and its reverse complement are the same word
+    (the reverse complement index gets the complement of the new
+    letter as its leading digit).
+
+    """
+    richness = np.zeros(max_k - 1)
+    letters_valid = codes < base
+    letters = np.where(letters_valid, codes, 0).astype(np.int64)
+    indices, valid = letters, letters_valid
+    reverse = letters ^ 1
+    for k in range(1, max_k):
+        if k > 1:
+            indices = indices[:-1] * base + letters[k-1:]
+            valid = valid[:-1] & letters_valid[k-1:]
+            if canonical:
+                reverse = reverse[:-1] + ((letters[k-1:] ^ 1) << (2*(k-1)))
+        if len(indices) == 0:
+            break
+        words = indices[valid]
+        if canonical:
+            words = np.minimum(words, reverse[valid])
+        if base**k <= 2**24:
+            counting = np.bincount(words, minlength=base**k)
+        else:
+            counting = np.unique(words, return_counts=True)[1]
+        richness[k-1] = np.count_nonzero(counting >= 2)
+    return richness
+
+
+def count_kmers(seq, k, alphabet="ATCG", canonical=False):
+    """It counts the occurrences of all the possible words of length k
+    in a sequence. The returned vector is sorted as all_w (canonical
+    words only if canonical, see kmer_indices).
+
+    """
+    codes = encode_sequence(seq, alphabet)
+    indices = kmer_indices(codes, k, len(alphabet), canonical=canonical)
+    return np.bincount(indices, minlength=profile_width(k, len(alphabet), canonical)).astype(np.int64)
+
+
+def count_kmers_chunks(chunks, k, alphabet="ATCG", sparse=False, canonical=False):
+    """It counts the words of length k of a sequence given as an
+    iterable of code arrays (see encode_sequence), updating the counts
+    chunk by chunk: the last k - 1 codes of a chunk are carried over to
+    the next one, so the words across the boundaries are not lost. It
+    returns the number of bases and either the dense vector sorted as
+    all_w or, if sparse, the sorted word indices and their occurrences.
+
+    """
+    base = len(alphabet)
+    width = profile_width(k, base, canonical)
+    carry = np.empty(0, dtype=np.uint8)
+    length = 0
+    if sparse:
+        words, counts = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    else:
+        counting = np.zeros(width, dtype=np.int64)
+    for codes in chunks:
+        length += len(codes)
+        codes = np.concatenate((carry, codes))
+        indices = kmer_indices(codes, k, base, canonical=canonical)
+        if sparse:
+            chunk_words, chunk_counts = np.unique(indices, return_counts=True)
+            words.append(chunk_words)
+            counts.append(chunk_counts)
+        else:
+            counting += np.bincount(indices, minlength=width)
+        carry = codes[max(len(codes) - (k - 1), 0):]
+    if not sparse:
+        return length, counting
+    words, inverse = np.unique(np.concatenate(words), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate(counts), minlength=len(words))
+    return length, (words.astype(np.uint64), counts.astype(np.int64))
+
+
+def count_kmers_sparse(seq, k, alphabet="ATCG", canonical=False):
+    """It counts the words of length k in a sequence keeping only the
+    observed ones: it returns the sorted word indices (positions in
+    all_w) and their occurrences.
+
+    """
+    codes = encode_sequence(seq, alphabet)
+    indices = kmer_indices(codes, k, len(alphabet), canonical=canonical)
+    words, counts = np.unique(indices, return_counts=True)
+    return words.astype(np.uint64), counts.astype(np.int64)
+
+
+def stack_sparse_counts(rows, width):
+    """It stacks a list of (sorted word indices, occurrences) into a
+    scipy.sparse CSR matrix with width columns."""
+    indptr = [0]
+    indices = [np.empty(0, dtype=np.int64)]
+    data = [np.empty(0, dtype=np.int64)]
+    for words, counts in rows:
+        indices.append(words.astype(np.int64))
+        data.append(counts)
+        indptr.append(indptr[-1] + len(words))
+    return scipy.sparse.csr_matrix((np.concatenate(data), np.concatenate(indices),
+                                    np.array(indptr, dtype=np.int64)),
+                                   shape=(len(indptr) - 1, width))
+
+
+def count_file(path, k, alphabet="ATCG", sparse=False, canonical=False, chunk_size=2**20):
+    """It parses a sequence file and counts the words of each of its
+    records while reading it (see count_kmers_chunks). It returns a list
+    of (name, length, counts) with the names as in read_seqs.
+
+    """
+    fil = os.path.basename(path)
+    fmt = sequence_format(fil)
+    if fmt == "fasta":
+        records = [(rec_id,) + count_kmers_chunks(chunks, k, alphabet, sparse, canonical)
+                   for rec_id, chunks in fasta_records(path, alphabet, chunk_size)]
+    elif fmt == "genbank":
+        records = [(rec_id,) + count_kmers_chunks([seq.codes()], k, alphabet, sparse, canonical)
+                   for rec_id, seq in read_genbank(path, alphabet)]
+    else:
+        raise ValueError("unknown sequence format: {}".format(fil))
+    return [(record_name(fil, rec_id, len(records)), length, counts)
+            for rec_id, length, counts in records]
+
+
+def _count_file_task(task):
+    #a failing file is reported, not raised, so that the batch goes on
+    try:
+        return count_file(*task), None
+    except Exception as error:
+        return [], "{}: {}".format(type(error).__name__, error)
+
+
+def _count_task(task):
+    seq, k, alphabet, sparse, canonical = task
+    if sparse:
+        return count_kmers_sparse(seq, k, alphabet, canonical)
+    return count_kmers(seq, k, alphabet, canonical)
+
+
+def ordered_results(function, tasks, processes=1, max_pending=None):
+    """It yields function(task) for each task, in the order of tasks.
+    With processes > 1 the tasks run in a process pool and at most
+    max_pending (default 2*processes) of them are submitted and not yet
+    consumed at any time, which bounds the memory held by the results.
+
+    """
+    if processes <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+    if max_pending is None:
+        max_pending = 2*processes
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.submit(function, task))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class RowWriter():
+
+    """It writes the rows of a 2-D array one after the other into a *.npy
+    file, without knowing their number in advance: the header reserves
+    room for the number of rows (see numpy.lib.format) and it is
+    rewritten in place by close, which returns the array memory-mapped.
+
+    """
+
+    def __init__(self, path, width, dtype=np.int64):
+        self.path = path
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.handle = open(path, "wb")
+        self.write_header()
+
+    def write_header(self):
+        np.lib.format.write_array_header_1_0(
+            self.handle, {"descr": np.lib.format.dtype_to_descr(self.dtype),
+                          "fortran_order": False, "shape": (self.rows, self.width)})
+
+    def append(self, row):
+        self.handle.write(np.ascontiguousarray(row, dtype=self.dtype).tobytes())
+        self.rows += 1
+
+    def close(self, mmap_mode="r"):
+        self.handle.seek(0)
+        self.write_header()
+        self.handle.close()
+        return np.load(self.path, mmap_mode=mmap_mode)
+
+
+class ProfileCache():
+
+    """A persistent on-disk cache of words' profiles. Each profile is
+    stored in a compressed *.npz file (sorted word indices and their
+    occurrences) named after a hash of the sequence content, k, the
+    alphabet and the sKmer binning, so an unchanged sequence is never
+    counted twice across runs. When the cache exceeds max_bytes, the
+    least recently used profiles are deleted.
+
+    """
+
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, codes, k, alphabet="ATCG", binning=None, canonical=False):
+        """The cache key of an encoded sequence (see encode_sequence)."""
+        digest = hashlib.sha1(np.ascontiguousarray(codes).tobytes())
+        digest.update("|{}|{}|{}".format(k, alphabet, binning).encode())
+        if canonical:
+            digest.update(b"|canonical")
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        """It returns the (word indices, occurrences) stored under key,
+        or None."""
+        try:
+            with np.load(self.path(key)) as data:
+                words, counts = data["words"].astype(np.uint64), data["counts"].astype(np.int64)
+        except (OSError, KeyError, ValueError):
+            return None
+        os.utime(self.path(key))  #the modification time tracks the last use
+        return words, counts
+
+    def store(self, key, words, counts):
+        """It saves a profile under key and evicts the least recently
+        used profiles beyond max_bytes."""
+        words_type = np.uint32 if len(words) == 0 or int(words[-1]) < 2**32 else np.uint64
+        tmp_path = self.path(key) + ".{}.tmp".format(os.getpid())
+        with open(tmp_path, "wb") as datafile_id:
+            np.savez_compressed(datafile_id, words=words.astype(words_type),
+                                counts=counts.astype(np.min_scalar_type(counts.max() if len(counts) else 0)))
+        os.replace(tmp_path, self.path(key))  #atomic: safe with concurrent runs
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def count(self, seqs, k, alphabet="ATCG", binning=None, canonical=False, processes=1,
+              progress=None):
+        """It returns the (word indices, occurrences) of each sequence in
+        seqs: the profiles found in the cache are loaded, the missing
+        ones are counted (in processes worker processes, see
+        ordered_results) and stored. progress, if given, is called as
+        progress(done, len(seqs)) once the cache is read and after each
+        sequence counted."""
+        keys = [self.key(encode_sequence(seq, alphabet), k, alphabet, binning, canonical) for seq in seqs]
+        rows = [self.load(key) for key in keys]
+        misses = [ind for ind, row in enumerate(rows) if row is None]
+        if progress is not None:
+            progress(len(seqs) - len(misses), len(seqs))
+        counted = ordered_results(_count_task, [(seqs[ind], k, alphabet, True, canonical) for ind in misses],
+                                  processes)
+        for done, (ind, (words, counts)) in enumerate(zip(misses, counted), len(seqs) - len(misses) + 1):
+            self.store(keys[ind], words, counts)
+            rows[ind] = words, counts
+            if progress is not None:
+                progress(done, len(seqs))
+        return rows
+
+
+def kmer_labels(indices, k, alphabet="ATCG"):
+    """It converts word indices (positions in all_w) back into the
+    words themselves. It returns an object array of strings.
+
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    base = len(alphabet)
+    powers = base ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    digits = (indices[:, None] // powers) % base
+    letters = np.frombuffer(alphabet.encode("ascii"), dtype=np.uint8)[digits]
+    return np.ascontiguousarray(letters).view("S{}".format(k)).ravel().astype(str).astype(object)
+
+
+def rank_profiles(profiles):
+    """It ranks the words' occurrences of each sequence (row), ties
+    getting the average rank as in scipy.stats.spearmanr. For a sparse
+    matrix of (non-negative) occurrences the ranks are shifted so that
+    the absent words get 0 and the result stays sparse: the shift
+    is the same along a row, so the correlations are not affected.
+
+    """
+    import scipy.stats
+    if not scipy.sparse.issparse(profiles):
+        return scipy.stats.rankdata(profiles, axis=1)
+    ranks = scipy.sparse.csr_matrix(profiles, dtype=np.float64, copy=True)
+    ranks.eliminate_zeros()
+    for row in range(0, ranks.shape[0]):
+        start, end = ranks.indptr[row], ranks.indptr[row+1]
+        zeros = ranks.shape[1] - (end - start)
+        ranks.data[start:end] = scipy.stats.rankdata(ranks.data[start:end]) + (zeros - 1) / 2
+    return ranks
+
+
+def pearson_matrix(profiles, others=None):
+    """It returns the Pearson correlation between every row of profiles
+    and every row of others (profiles itself if None) as a single
+    normalized matrix product. Both dense and scipy.sparse inputs are
+    accepted.
+
+    """
+    if others is None:
+        others = profiles
+    length = profiles.shape[1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if scipy.sparse.issparse(profiles) or scipy.sparse.issparse(others):
+            profiles = scipy.sparse.csr_matrix(profiles, dtype=np.float64)
+            others = scipy.sparse.csr_matrix(others, dtype=np.float64)
+            sum_x = np.asarray(profiles.sum(axis=1)).ravel()
+            sum_y = np.asarray(others.sum(axis=1)).ravel()
+            var_x = np.asarray(profiles.multiply(profiles).sum(axis=1)).ravel() - sum_x**2 / length
+            var_y = np.asarray(others.multiply(others).sum(axis=1)).ravel() - sum_y**2 / length
+            cov = (profiles @ others.T).toarray() - np.outer(sum_x, sum_y) / length
+            corr = cov / np.sqrt(np.outer(var_x, var_y))
+        else:
+            profiles = np.asarray(profiles, dtype=np.float64)
+            others = np.asarray(others, dtype=np.float64)
+            centred_x = profiles - profiles.mean(axis=1, keepdims=True)
+            centred_y = others - others.mean(axis=1, keepdims=True)
+            centred_x /= np.linalg.norm(centred_x, axis=1, keepdims=True)
+            centred_y /= np.linalg.norm(centred_y, axis=1, keepdims=True)
+            corr = centred_x @ centred_y.T
+    return np.clip(corr, -1, 1)
+
+
+def tie_ranks(profile):
+    """It sorts a vector of occurrences (dense or a scipy.sparse row)
+    once and returns what the Kendall tau-b of any pair including it
+    needs: the positions of the non-zero values and their dense ranks
+    (0, 1, ... for the distinct values in increasing order, 0 included),
+    the rank of the zeros, the length of the vector, the number of
+    distinct values and the number of tied pairs. The zeros are only
+    counted, so that the memory scales with the words observed.
+
+    """
+    if scipy.sparse.issparse(profile):
+        profile = scipy.sparse.coo_matrix(profile)
+        size = profile.shape[0] * profile.shape[1]
+        positions = profile.row.astype(np.int64) * profile.shape[1] + profile.col
+        data = profile.data
+        keep = data != 0
+        positions, data = positions[keep], data[keep]
+        order = np.argsort(positions, kind="stable")
+        positions, data = positions[order], data[order]
+    else:
+        profile = np.asarray(profile).ravel()
+        size = len(profile)
+        positions = np.flatnonzero(profile)
+        data = profile[positions]
+    values, ranks, counts = np.unique(data, return_inverse=True, return_counts=True)
+    counts = counts.astype(np.int64)
+    ranks = ranks.ravel()
+    zeros = size - len(data)
+    zero_rank = int(np.searchsorted(values, 0))
+    if zeros > 0:
+        ranks = ranks + (ranks >= zero_rank)
+        counts = np.insert(counts, zero_rank, zeros)
+    else:
+        zero_rank = 0  #no zeros: the class stays empty
+    distinct = len(counts)
+    ranks = ranks.astype(np.min_scalar_type(max(distinct - 1, 0)))
+    positions = positions.astype(np.min_scalar_type(max(size - 1, 0)))
+    return positions, ranks, zero_rank, size, distinct, int((counts * (counts - 1) // 2).sum())
+
+
+def profile_ranks(profiles):
+    """It returns the tie_ranks of every row of profiles (dense or
+    scipy.sparse), without densifying the sparse rows."""
+    if scipy.sparse.issparse(profiles):
+        profiles = scipy.sparse.csr_matrix(profiles)
+        return [tie_ranks(profiles[row]) for row in range(0, profiles.shape[0])]
+    return [tie_ranks(row) for row in profiles]
+
+
+def count_inversions(values):
+    """It counts the pairs i < j with values[i] > values[j] of a vector
+    of non-negative integers through a bottom-up merge sort, each level
+    being merged for all the blocks at once (O(n log^2 n), vectorized).
+
+    """
+    values = np.asarray(values, dtype=np.int64)
+    length = len(values)
+    if length < 2:
+        return 0
+    top = int(values.max()) + 1
+    pos = np.arange(length, dtype=np.int64)
+    inversions = 0
+    width = 1
+    while width < length:
+        block = pos // (2*width)
+        right = (pos // width) % 2 == 1
+        keys = block * top + values
+        left_keys = keys[~right]  #already sorted: blocks are sorted at the previous level
+        left_end = np.searchsorted(left_keys, (block[right] + 1) * top, side="left")
+        inversions += int((left_end - np.searchsorted(left_keys, keys[right], side="right")).sum())
+        values = np.sort(keys) - block * top
+        width *= 2
+    return inversions
+
+
+def kendall_from_ranks(rank_x, rank_y):
+    """It returns the Kendall tau-b of two sequences given their
+    tie_ranks. For sparse sequences only the positions where either of
+    them is non-zero are paired explicitly; the ones where both are zero
+    are added as a single class. The discordant pairs are counted on the contingency
+    table of the two rankings when it is small (few distinct
+    occurrences, the usual case for k-mer counts), otherwise sorting the
+    pairs and counting the inversions. Ties are handled as in
+    scipy.stats.kendalltau.
+
+    """
+    positions_x, ranks_x, zero_x, size, values_x, ties_x = rank_x
+    positions_y, ranks_y, zero_y, size_y, values_y, ties_y = rank_y
+    total = size * (size - 1) // 2
+    if 4 * (len(positions_x) + len(positions_y)) > size:
+        #mostly non-zero: the rankings are paired position by position
+        pairs_x = np.full(size, zero_x, dtype=np.int64)
+        pairs_x[positions_x] = ranks_x
+        pairs_y = np.full(size, zero_y, dtype=np.int64)
+        pairs_y[positions_y] = ranks_y
+    else:
+        common, in_x, in_y = np.intersect1d(positions_x, positions_y, assume_unique=True,
+                                            return_indices=True)
+        only_x = np.ones(len(positions_x), dtype=bool)
+        only_x[in_x] = False
+        only_y = np.ones(len(positions_y), dtype=bool)
+        only_y[in_y] = False
+        pairs_x = np.concatenate([ranks_x[in_x], ranks_x[only_x],
+                                  np.full(np.count_nonzero(only_y), zero_x)]).astype(np.int64)
+        pairs_y = np.concatenate([ranks_y[in_y], np.full(np.count_nonzero(only_x), zero_y),
+                                  ranks_y[only_y]]).astype(np.int64)
+    both_zero = size - len(pairs_x)
+    if values_x * values_y <= max(size, 2**16):
+        table = np.bincount(pairs_x * values_y + pairs_y,
+                            minlength=values_x * values_y).reshape(values_x, values_y)
+        table[zero_x, zero_y] += both_zero
+        ties_xy = int((table * (table - 1) // 2).sum())
+        #pairs with a larger rank in x and a smaller rank in y
+        lower_left = np.cumsum(np.cumsum(table[::-1], axis=0)[::-1], axis=1)
+        lower_left = np.pad(lower_left[1:, :-1], ((0, 1), (1, 0)))
+        discordant = int((table * lower_left).sum())
+    else:
+        order = np.lexsort((pairs_y, pairs_x))
+        sorted_x = pairs_x[order]
+        sorted_y = pairs_y[order]
+        joint = np.r_[True, (sorted_x[1:] != sorted_x[:-1]) | (sorted_y[1:] != sorted_y[:-1]), True]
+        counts = np.diff(np.nonzero(joint)[0]).astype(np.int64)
+        ties_xy = int((counts * (counts - 1) // 2).sum()) + both_zero * (both_zero - 1) // 2
+        #the zeros of both sequences are discordant with the pairs on the other diagonal
+        discordant = count_inversions(sorted_y) + both_zero * int(np.count_nonzero(
+            (pairs_x - zero_x) * (pairs_y - zero_y) < 0))
+    if total == ties_x or total == ties_y:
+        return mt.nan
+    tau = ((total - ties_x - ties_y + ties_xy) - 2 * discordant) / mt.sqrt(total - ties_x) / mt.sqrt(
+        total - ties_y)
+    return min(1., max(-1., tau))
+
+
+def kendall_tau(x, y):
+    """Kendall tau-b of two vectors (same value as scipy.stats.kendalltau)."""
+    return kendall_from_ranks(tie_ranks(x), tie_ranks(y))
+
+
+MEASURES = {"P": "Pearson", "S": "Spearman", "T": "Kendall", "C": "Cosine",
+            "D2*": "d2*", "D2S": "d2S", "JS": "Jensen-Shannon"}
+
+
+def dense_rows(profiles):
+    """It returns the profiles (one row per sequence) as a dense float
+    array."""
+    if scipy.sparse.issparse(profiles):
+        return profiles.toarray().astype(np.float64)
+    return np.asarray(profiles, dtype=np.float64)
+
+
+def unit_rows(profiles):
+    """It divides every row of profiles (dense or scipy.sparse) by its
+    Euclidean norm; a sparse matrix stays sparse."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if scipy.sparse.issparse(profiles):
+            profiles = scipy.sparse.csr_matrix(profiles, dtype=np.float64)
+            norms = np.sqrt(np.asarray(profiles.multiply(profiles).sum(axis=1)).ravel())
+            return scipy.sparse.csr_matrix(profiles.multiply(1 / norms[:, None]))
+        profiles = np.asarray(profiles, dtype=np.float64)
+        return profiles / np.linalg.norm(profiles, axis=1, keepdims=True)
+
+
+def unit_products(units, others):
+    """It returns the matrix products of two sets of unit_rows, i.e.
+    their cosine similarities."""
+    if scipy.sparse.issparse(units) or scipy.sparse.issparse(others):
+        products = scipy.sparse.csr_matrix(units) @ scipy.sparse.csr_matrix(others).T
+        return np.clip(products.toarray(), -1, 1)
+    return np.clip(units @ others.T, -1, 1)
+
+
+def check_markov_order(k, order):
+    """It raises a ValueError unless a Markov background of the given
+    order can be fitted on the k-mers: with order >= k - 1 the
+    background predicts the k-mers from themselves and the d2* and d2S
+    are left with noise, hence 0 <= order <= k - 2 (and k >= 2)."""
+    if k < 2:
+        raise ValueError("a Markov background needs words of at least 2 letters, not k = {}".format(k))
+    if not 0 <= order <= k - 2:
+        raise ValueError("the Markov order must be between 0 and k - 2 = {}, not {}".format(k - 2, order))
+
+
+def markov_background(profiles, order=1):
+    """It fits a Markov background of the given order on each sequence
+    from its profile (dense or scipy.sparse), without reading it again:
+    the frequencies of the (order+1)-mers are obtained by summing the
+    occurrences of the k-mers sharing their prefix. It returns a dict
+    with k, the length m = order + 1 of the words fitted (see
+    check_markov_order for the valid orders), the total occurrences
+    and the log frequencies of the m-mers and of the (m-1)-mers of
+    every sequence, which is all background_expected needs. The
+    profiles must cover all the 4**k words in the order of all_w (no
+    canonical profiles).
+
+    """
+    size, width = profiles.shape
+    k = int(round(mt.log(width, 4))) if width > 1 else 0
+    if k == 0 or 4**k != width:
+        raise ValueError("a Markov background needs profiles of all the 4**k words (not canonical)")
+    check_markov_order(k, order)
+    length = order + 1
+    if scipy.sparse.issparse(profiles):
+        profiles = scipy.sparse.csr_matrix(profiles)
+        prefixes = scipy.sparse.csr_matrix((profiles.data.astype(np.float64),
+                                            profiles.indices // 4**(k - length), profiles.indptr),
+                                           shape=(size, 4**length))
+        counts = prefixes.toarray()  #the duplicated prefixes are summed
+    else:
+        counts = np.asarray(profiles, dtype=np.float64).reshape(size, 4**length, 4**(k - length)).sum(axis=2)
+    totals = counts.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        freqs = counts / totals[:, None]
+        return {"k": k, "length": length, "totals": totals, "log_freqs": np.log(freqs),
+                "log_prefixes": np.log(freqs.reshape(size, 4**(length - 1), 4).sum(axis=2))}
+
+
+def background_expected(background, rows=slice(None)):
+    """It returns the occurrences expected under a markov_background for
+    the sequences rows, as a dense (rows, 4**k) array; the probability
+    of a word is
+
+        p(w) = f(w_1..w_m) * prod_j f(w_j..w_j+m-1) / f(w_j..w_j+m-2)
+
+    """
+    k, length = background["k"], background["length"]
+    log_freqs = background["log_freqs"][rows]
+    size = log_freqs.shape[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        #log f(w_j..w_j+m-1) - log f(w_j..w_j+m-2), by (m-1)-mer and next letter
+        transitions = log_freqs.reshape(size, 4**(length - 1), 4) - background["log_prefixes"][rows][:, :, None]
+        log_p = log_freqs
+        for width in range(length, k):  #the words are extended by one letter at a time
+            log_p = (log_p.reshape(size, -1, 4**(length - 1), 1) + transitions[:, None]).reshape(
+                size, 4**(width + 1))
+        expected = background["totals"][rows][:, None] * np.exp(log_p)
+    return np.nan_to_num(expected, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def d2star_rows(counts, expected):
+    """It centres the occurrences on the ones expected from the Markov
+    background of each sequence (see background_expected) and divides
+    them by the square root of the latter: the normalized d2*
+    similarity (Reinert et al., 2009) of two sequences is the cosine
+    of the results, which are returned as unit_rows (see
+    unit_products). It ranges in [-1, 1] as the correlation functions."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = (counts - expected) / np.sqrt(expected)
+    values[expected == 0] = 0
+    return unit_rows(values)
+
+
+def d2s_centred(centred_x, centred_y, max_values=2**24, lower=False):
+    """It returns the normalized d2S similarity (Wan et al., 2010) of
+    every row of centred_x against every row of centred_y, the
+    occurrences X~ and Y~ being already centred on their Markov
+    background (see background_expected):
+
+        D2S = sum X~ Y~ / sqrt(X~**2 + Y~**2)
+
+    normalized by sqrt(sum X~**2 / sqrt(X~**2 + Y~**2)) and the same
+    for Y~, so that it ranges in [-1, 1]. The weights depend on both
+    sequences, hence each row is compared with (at most
+    max_values / width) rows of centred_y at once. With lower, only
+    the columns up to the row (included) are computed, the rest being
+    left to 0."""
+    matrix = np.zeros((centred_x.shape[0], centred_y.shape[0]))
+    batch = max(1, max_values // max(centred_x.shape[1], 1))
+    squares_y = centred_y**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for row, values in enumerate(centred_x):
+            end = row + 1 if lower else centred_y.shape[0]
+            for start in range(0, end, batch):
+                stop = min(start + batch, end)
+                scale = np.sqrt(values**2 + squares_y[start:stop])
+                scale[scale == 0] = np.inf  #words centred to 0 in both sequences do not count
+                D2S = (values * centred_y[start:stop] / scale).sum(axis=1)
+                norm_x = (values**2 / scale).sum(axis=1)
+                norm_y = (squares_y[start:stop] / scale).sum(axis=1)
+                matrix[row, start:stop] = D2S / np.sqrt(norm_x * norm_y)
+    return np.clip(matrix, -1, 1)
+
+
+def word_frequencies(profiles):
+    """It returns the word frequencies of every row of profiles (a
+    sparse matrix stays sparse) and their entropies in bits."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if scipy.sparse.issparse(profiles):
+            profiles = scipy.sparse.csr_matrix(profiles, dtype=np.float64)
+            totals = np.asarray(profiles.sum(axis=1)).ravel()
+            freqs = scipy.sparse.csr_matrix(profiles.multiply(1 / totals[:, None]))
+            terms = freqs.copy()
+            terms.data = np.where(terms.data > 0, terms.data * np.log2(terms.data), 0)
+            return freqs, -np.asarray(terms.sum(axis=1)).ravel()
+        profiles = np.asarray(profiles, dtype=np.float64)
+        freqs = profiles / profiles.sum(axis=1, keepdims=True)
+        return freqs, -np.where(freqs > 0, freqs * np.log2(freqs), 0).sum(axis=1)
+
+
+def js_frequencies(freqs_x, entropy_x, freqs_y, entropy_y, max_values=2**24, lower=False):
+    """It returns 1 - the Jensen-Shannon divergence (in bits, so it
+    ranges in [0, 1] and 1 means equal frequencies) of every row of
+    freqs_x against every row of freqs_y, given their entropies (see
+    word_frequencies). The divergence depends on both sequences word
+    by word, hence each row is compared with (at most
+    max_values / width) rows of freqs_y at once. With lower, only the
+    columns up to the row (included) are computed, the rest being left
+    to 0."""
+    freqs_x, freqs_y = dense_rows(freqs_x), dense_rows(freqs_y)
+    matrix = np.zeros((freqs_x.shape[0], freqs_y.shape[0]))
+    batch = max(1, max_values // max(freqs_x.shape[1], 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for row, values in enumerate(freqs_x):
+            end = row + 1 if lower else freqs_y.shape[0]
+            for start in range(0, end, batch):
+                stop = min(start + batch, end)
+                mixture = (values + freqs_y[start:stop]) / 2
+                entropy_m = -np.where(mixture > 0, mixture * np.log2(mixture), 0).sum(axis=1)
+                divergence = entropy_m - (entropy_x[row] + entropy_y[start:stop]) / 2
+                matrix[row, start:stop] = 1 - divergence
+    return np.clip(matrix, 0, 1)
+
+
+def paired_correlations(values_x, values_y, name):
+    """It correlates each row of values_x with the same row of values_y
+    using the correlation function name ("P", "S" or "T"). Pearson and
+    Spearman are computed for all the rows at once.
+
+    """
+    if name == "T":
+        return np.array([kendall_tau(row_x, row_y) for row_x, row_y in zip(values_x, values_y)])
+    if name == "S":
+        import scipy.stats
+        values_x = scipy.stats.rankdata(values_x, axis=1)
+        values_y = scipy.stats.rankdata(values_y, axis=1)
+    centred_x = values_x - values_x.mean(axis=1, keepdims=True)
+    centred_y = values_y - values_y.mean(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = (centred_x * centred_y).sum(axis=1) / np.sqrt(
+            (centred_x**2).sum(axis=1) * (centred_y**2).sum(axis=1))
+    return np.clip(corr, -1, 1)
+
+
+def bootstrap_replicates(profile_x, profile_y, B, tolerance, rng, max_values=2**24, counters=None):
+    """It draws B bootstrap replicates of a pair of sequences: the words
+    (i.e. their indices in all_w) are sampled with replacement with
+    rng.integers and the occurrences are gathered by fancy indexing.
+    A replicate is drawn again as long as both the new sequences have a
+    size out of the original one +/- tolerance. The replicates are
+    yielded in batches of (at most max_values / len(profile_x)) rows.
+    The replicates and the rejected resamples are added to counters
+    (a dict), if given.
+
+    """
+    length = len(profile_x)
+    low_tol_N, up_tol_N = profile_x.sum() - tolerance, profile_x.sum() + tolerance
+    low_tol_M, up_tol_M = profile_y.sum() - tolerance, profile_y.sum() + tolerance
+    batch = max(1, max_values // max(length, 1))
+    for start in range(0, B, batch):
+        size = min(batch, B - start)
+        values_N = np.empty((size, length), dtype=profile_x.dtype)
+        values_M = np.empty((size, length), dtype=profile_y.dtype)
+        todo = np.arange(size)
+        #the while loop forces the size within the tolerance level
+        while len(todo) > 0:
+            sample_keys = rng.integers(0, length, (len(todo), length))
+            values_N[todo] = profile_x[sample_keys]
+            values_M[todo] = profile_y[sample_keys]
+            new_size_N = values_N[todo].sum(axis=1)
+            new_size_M = values_M[todo].sum(axis=1)
+            todo = todo[((new_size_N <= low_tol_N) | (new_size_N >= up_tol_N)) & (
+                (new_size_M <= low_tol_M) | (new_size_M >= up_tol_M))]
+            if counters is not None:
+                counters["rejected_resamples"] += len(todo)
+        if counters is not None:
+            counters["replicates"] += size
+        yield values_N, values_M
+
+
+def bca_interval(corr_values, theta, alpha, BCa=True):
+    """It returns the confidence interval (low, up) of the correlation
+    value theta given its bootstrap replicates corr_values.
+
+    With BCa, the bias-correction is given by the fraction of replicates
+    below theta and the acceleration by the jackknife of the replicates:
+    the leave-one-out means are obtained in O(B) from the total sum, so
+    a = sum(d**3) / (6 * sum(d**2)**(3/2)) with d = mean - theta_(i).
+
+    """
+    import scipy.stats
+    corr_values = np.sort(np.asarray(corr_values, dtype=np.float64))
+    B = len(corr_values)
+    CL = 1 - alpha
+    if BCa:
+        z = scipy.stats.norm.ppf(alpha)
+        zop = scipy.stats.norm.ppf(CL)
+        jack_theta = (corr_values.sum() - corr_values) / (B - 1)
+        dev = jack_theta.mean() - jack_theta
+        with np.errstate(divide="ignore", invalid="ignore"):
+            accel = (dev**3).sum() / (6 * ((dev**2).sum())**(3/2))
+        if not np.isfinite(accel):
+            accel = 0
+        z_zero = scipy.stats.norm.ppf(np.count_nonzero(corr_values < theta) / B)
+        lower_alpha = scipy.stats.norm.cdf(z_zero + (z_zero + z)/(1 - accel*(z_zero + z)))*B
+        upper_alpha = scipy.stats.norm.cdf(z_zero + (z_zero + zop)/(1 - accel*(z_zero + zop)))*B
+    else:
+        lower_alpha = B*(1 - CL)
+        upper_alpha = CL*B
+    if np.isnan(lower_alpha) or np.isnan(upper_alpha):
+        return mt.nan, mt.nan
+    lower_alpha = min(max(int(lower_alpha), 1), B)
+    upper_alpha = min(max(int(mt.ceil(upper_alpha)), 1), B)
+    return corr_values[lower_alpha - 1], corr_values[upper_alpha - 1]
+
+
+CI_FIELDS = [("reference", np.int64), ("sequence", np.int64),
+             ("spearman_low", np.float64), ("spearman_up", np.float64), ("spearman", np.float64),
+             ("kendall_low", np.float64), ("kendall_up", np.float64), ("kendall", np.float64),
+             ("pearson_low", np.float64), ("pearson_up", np.float64), ("pearson", np.float64)]
+
+BOOT_DATA = {}
+
+
+def _bootstrap_init(profiles):
+    BOOT_DATA["profiles"] = profiles
+
+
+def _bootstrap_pair(task):
+    """It bootstraps a pair of sequences and returns its confidence
+    intervals laid out as CI_FIELDS (without the indices) and the
+    counters of bootstrap_replicates."""
+    x, y, thetas, corr, alpha, tolerance, B, BCa, seed = task
+    profiles = BOOT_DATA["profiles"]
+    if scipy.sparse.issparse(profiles):
+        profile_x, profile_y = (profiles[ind].toarray().ravel() for ind in (x, y))
+    else:
+        profile_x, profile_y = profiles[x], profiles[y]
+    layout = corr_layout(corr)
+    corr_values = [[] for l in range(0, len(layout))]
+    counters = collections.Counter()
+    for values_N, values_M in bootstrap_replicates(profile_x, profile_y, B, tolerance,
+                                                   np.random.default_rng(seed), counters=counters):
+        for ind, (pos, name) in enumerate(layout):
+            corr_values[ind].extend(paired_correlations(values_N, values_M, name))
+    interval = [mt.nan]*9
+    for ind, (pos, name) in enumerate(layout):
+        column = 3 * "STP".index(name)
+        interval[column:column+2] = bca_interval(corr_values[ind], thetas[ind], alpha, BCa)
+        interval[column+2] = thetas[ind]
+    return tuple(interval), counters
+
+
+def corr_layout(corr):
+    """It returns the correlation functions selected by corr ("P", "S",
+    "T" or "ALL") together with the matrix of corr_matrix they fill.
+    The other measures of MEASURES are single choices filling the
+    first matrix, as "P", "S" or "T".
+
+    """
+    if corr in MEASURES:
+        return [(0, corr)]
+    return [(0, "S"), (1, "T"), (2, "P")]
+
+
+def prepare_profiles(profiles, corr, markov_order=1):
+    """It computes once what the correlation functions in corr need
+    from the stacked profiles: the ranks for Spearman, the tie_ranks
+    for Kendall, the unit rows for the cosine, the frequencies and
+    their entropies for the Jensen-Shannon divergence and the Markov
+    background of order markov_order for the d2* and d2S (see
+    markov_background). The background is fitted once per sequence;
+    dense profiles are also standardized (d2*) or centred (d2S) once,
+    while sparse ones are so only block by block (see correlation_block),
+    so that they are never densified as a whole.
+
+    """
+    functions = [name for ind, name in corr_layout(corr)]
+    prepared = {"P": profiles, "S": None, "T": None, "C": None, "JS": None, "D2*": None,
+                "D2S": None, "background": None}
+    if "S" in functions:
+        prepared["S"] = rank_profiles(profiles)
+    if "T" in functions:
+        prepared["T"] = profile_ranks(profiles)
+    if "C" in functions:
+        prepared["C"] = unit_rows(profiles)
+    if "JS" in functions:
+        prepared["JS"] = word_frequencies(profiles)
+    if "D2*" in functions or "D2S" in functions:
+        prepared["background"] = markov_background(profiles, markov_order)
+        if not scipy.sparse.issparse(profiles):
+            counts, expected = dense_rows(profiles), background_expected(prepared["background"])
+            if "D2*" in functions:
+                prepared["D2*"] = d2star_rows(counts, expected)
+            if "D2S" in functions:
+                prepared["D2S"] = counts - expected
+    return prepared
+
+
+def background_rows(prepared, rows, name):
+    """It returns the rows of prepared standardized for the d2* or
+    centred for the d2S (name), computing them from the Markov
+    background if they were not prepared as a whole."""
+    if prepared[name] is not None:
+        return prepared[name][rows]
+    counts = dense_rows(prepared["P"][rows])
+    expected = background_expected(prepared["background"], rows)
+    if name == "D2*":
+        return d2star_rows(counts, expected)
+    return counts - expected
+
+
+DENSE_MEASURES = ("D2*", "D2S", "JS")
+
+TILE_VALUES = 2**22
+
+
+def measure_block_size(profiles, corr, block_size=None):
+    """It returns block_size or, if it is not given and corr includes a
+    measure which densifies sparse profiles block by block (see
+    DENSE_MEASURES), the number of sequences per side of a tile keeping
+    each dense block within TILE_VALUES values."""
+    if (block_size is None or block_size <= 0) and scipy.sparse.issparse(profiles) and any(
+            name in DENSE_MEASURES for ind, name in corr_layout(corr)):
+        return max(1, TILE_VALUES // max(profiles.shape[1], 1))
+    return block_size
+
+
+PAIRWISE_MEASURES = ("T", "D2S", "JS")
+PROGRESS_STEPS = 20
+
+
+def correlation_block(prepared, rows, others, cols, corr, progress=None):
+    """It correlates the sequences rows of prepared against the
+    sequences cols of others (both from prepare_profiles). It returns
+    a (3, len(rows), len(cols)) array laid out as corr_matrix. On a
+    diagonal tile (the same sequences on both sides) the measures
+    computed pair by pair (Kendall, d2S, Jensen-Shannon) only fill the
+    lower triangle, mirrored in the upper one.
+
+    progress, if given, is called as progress(done, len(rows)): the
+    measures computed pair by pair are then split in (about
+    PROGRESS_STEPS) blocks of rows, reported as each one is done.
+
+    """
+    block = np.zeros((3, len(rows), len(cols)))
+    diagonal = others is prepared and np.array_equal(rows, cols)
+    if progress is not None and len(rows) > 1 and any(
+            name in PAIRWISE_MEASURES for ind, name in corr_layout(corr)):
+        step = max(-(-len(rows) // PROGRESS_STEPS), 1)
+        for start in range(0, len(rows), step):
+            stop = min(start + step, len(rows))
+            if not diagonal:
+                block[:, start:stop] = correlation_block(prepared, rows[start:stop], others, cols, corr)
+            else:  #the rows block against the previous columns, then its own diagonal tile
+                if start > 0:
+                    block[:, start:stop, :start] = correlation_block(prepared, rows[start:stop], others,
+                                                                     cols[:start], corr)
+                block[:, start:stop, start:stop] = correlation_block(prepared, rows[start:stop], others,
+                                                                     cols[start:stop], corr)
+            progress(stop, len(rows))
+        if diagonal:
+            for ind in range(0, 3):
+                block[ind] = np.tril(block[ind]) + np.tril(block[ind], -1).T
+        return block
+    for ind, name in corr_layout(corr):
+        if name == "P":
+            block[ind] = pearson_matrix(prepared["P"][rows], others["P"][cols])
+        elif name == "S":
+            block[ind] = pearson_matrix(prepared["S"][rows], others["S"][cols])
+        elif name == "C":
+            block[ind] = unit_products(prepared["C"][rows], others["C"][cols])
+        elif name in ("D2*", "D2S"):
+            values_x = background_rows(prepared, rows, name)
+            if diagonal:
+                values_y = values_x
+            else:
+                values_y = background_rows(others, cols, name)
+            if name == "D2*":
+                block[ind] = unit_products(values_x, values_y)
+            else:
+                block[ind] = d2s_centred(values_x, values_y, lower=diagonal)
+        elif name == "JS":
+            (freqs_x, entropy_x), (freqs_y, entropy_y) = prepared["JS"], others["JS"]
+            block[ind] = js_frequencies(freqs_x[rows], entropy_x[rows], freqs_y[cols], entropy_y[cols],
+                                        lower=diagonal)
+        else:
+            for row, x in enumerate(rows):
+                for col, y in enumerate(cols[:row + 1] if diagonal else cols):
+                    block[ind][row][col] = kendall_from_ranks(prepared["T"][x], others["T"][y])
+        if diagonal and name in PAIRWISE_MEASURES:
+            block[ind] = block[ind] + np.tril(block[ind], -1).T
+    return block
+
+
+TILE_DATA = {}
+
+
+def _tile_init(prepared, corr, others=None, progress=None):
+    TILE_DATA["prepared"] = prepared
+    TILE_DATA["others"] = prepared if others is None else others
+    TILE_DATA["corr"] = corr
+    TILE_DATA["progress"] = progress
+
+
+def _tile_worker(tile):
+    rows, cols = tile
+    progress = TILE_DATA.get("progress")
+    if progress is not None:
+        progress = functools.partial(progress, tile)
+    return tile, correlation_block(TILE_DATA["prepared"], np.arange(*rows), TILE_DATA["others"],
+                                   np.arange(*cols), TILE_DATA["corr"], progress)
+
+
+def compute_tiles(tiles, prepared, corr, store, others=None, processes=1, progress=None):
+    """It computes the correlation_block of each tile, given as
+    ((row start, row end), (col start, col end)), of prepared against
+    others (prepared itself if None) and passes it to
+    store(tile, block) as soon as it is done. With processes > 1 the
+    tiles are computed in a process pool, at most 2*processes of them
+    being held in memory at any time. Otherwise progress, if given, is
+    called as progress(tile, done rows, total rows) within each tile
+    (see correlation_block).
+
+    """
+    if processes > 1 and len(tiles) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, initializer=_tile_init,
+                initargs=(prepared, corr, others)) as pool:
+            pending = set()
+            for tile in tiles:
+                pending.add(pool.submit(_tile_worker, tile))
+                if len(pending) >= 2*processes:  #bounded number of tiles in memory
+                    finished, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        store(*future.result())
+            for future in concurrent.futures.as_completed(pending):
+                store(*future.result())
+    else:
+        _tile_init(prepared, corr, others, progress)
+        for tile in tiles:
+            store(*_tile_worker(tile))
+        _tile_init(None, None)
+
+
+def row_tiles(start, end, columns, block_size=None, processes=1):
+    """It splits the rows start:end in tiles of block_size rows spanning
+    the columns 0:columns; by default, one tile per process."""
+    if block_size is None or block_size <= 0:
+        block_size = max(-(-(end - start) // max(processes, 1)), 1)
+    return [((row, min(row + block_size, end)), (0, columns)) for row in range(start, end, block_size)]
+
+
+def cross_correlations(profiles, others, corr, processes=1, block_size=None, markov_order=1):
+    """It correlates every row of profiles against every row of others
+    (e.g. the windows of two sequences) without building the
+    correlations within each of them. It returns a
+    (3, len(profiles), len(others)) array laid out as corr_matrix; the
+    rows are split in blocks of block_size computed in a process pool
+    when processes > 1 (see measure_block_size for the default).
+    markov_order is the order of the background of the d2* and d2S.
+
+    """
+    matrix = np.zeros((3, profiles.shape[0], others.shape[0]))
+
+    def store(tile, block):
+        (row_start, row_end), cols = tile
+        matrix[:, row_start:row_end] = block
+
+    block_size = measure_block_size(profiles, corr, block_size)
+    compute_tiles(row_tiles(0, profiles.shape[0], others.shape[0], block_size, processes),
+                  prepare_profiles(profiles, corr, markov_order), corr, store,
+                  prepare_profiles(others, corr, markov_order), processes)
+    return matrix
+
+
+LOCAL_FIELDS = [("x", np.int64), ("y", np.int64), ("offset", np.int64),
+                ("rows", np.int64), ("cols", np.int64)]
+
+
+def _local_pair(pair):
+    x, y = pair
+    prepared = TILE_DATA["prepared"]
+    return correlation_block(prepared[x], np.arange(prepared[x]["P"].shape[0]), prepared[y],
+                             np.arange(prepared[y]["P"].shape[0]), TILE_DATA["corr"])
+
+
+def pairwise_blocks(profiles, pairs, corr, processes=1, markov_order=1):
+    """It correlates the windows of the sequences in each pair (x, y)
+    of pairs, given profiles, a dict of window profiles per sequence:
+    only the cross-sequence blocks are computed, one task per pair in a
+    process pool when processes > 1. Every sequence is prepared (ranked)
+    once whatever the number of pairs it is in.
+
+    It returns a flat buffer with the (3, X windows, Y windows) blocks
+    one after the other and their index (see LOCAL_FIELDS): the block of
+    the i-th pair is buffer[offset:offset + 3*rows*cols]. markov_order
+    is the order of the background of the d2* and d2S.
+
+    """
+    prepared = {ind: prepare_profiles(profiles[ind], corr, markov_order)
+                for ind in sorted(set(itertools.chain.from_iterable(pairs)))}
+    if processes > 1 and len(pairs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, initializer=_tile_init,
+                initargs=(prepared, corr)) as pool:
+            blocks = list(pool.map(_local_pair, pairs))
+    else:
+        _tile_init(prepared, corr)
+        blocks = [_local_pair(pair) for pair in pairs]
+        _tile_init(None, None)
+    index = np.zeros(len(pairs), dtype=LOCAL_FIELDS)
+    offset = 0
+    for ind, ((x, y), block) in enumerate(zip(pairs, blocks)):
+        index[ind] = (x, y, offset, block.shape[1], block.shape[2])
+        offset += block.size
+    buffer = np.concatenate([block.ravel() for block in blocks]) if blocks else np.empty(0)
+    return buffer, index
+
+
+def profiles_digest(profiles, block=2**12):
+    """It returns the SHA-256 digest of the stacked profiles (dense or
+    scipy.sparse), hashed block of rows by block of rows so that a
+    memory-mapped matrix is not loaded at once."""
+    digest = hashlib.sha256()
+    if scipy.sparse.issparse(profiles):
+        profiles = scipy.sparse.csr_matrix(profiles)
+        for array in (profiles.indptr, profiles.indices, profiles.data):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+    for start in range(0, profiles.shape[0], block):
+        digest.update(np.ascontiguousarray(profiles[start:start+block]).tobytes())
+    return digest.hexdigest()
+
+
+def tiled_correlations(profiles, corr, block_size=None, processes=1, out_path=None,
+                       resume=True, progress=None, markov_order=1, run_info=None):
+    """It computes the all-vs-all correlation matrices (laid out as
+    corr_matrix) tiling the lower triangle into blocks of block_size
+    sequences (by default, enough tiles for 2*processes workers, the
+    whole matrix with a single process, see also measure_block_size).
+    The tiles are computed in a process pool when
+    processes > 1 and written as they finish, mirrored in the upper
+    triangle.
+
+    If out_path is given, the result is a memory-mapped *.npy file,
+    so that it can exceed the RAM, and the completed tiles are logged
+    in out_path + ".tiles": an interrupted run called again with
+    resume=True only computes the missing tiles. The log starts with a
+    fingerprint of the run (corr, block_size, markov_order, the digest
+    of the profiles and run_info, a dict such as k and the files): if
+    it differs from the one of the previous run, everything is computed
+    again.
+
+    progress, if given, is called as progress(done, total), counting
+    the pairs of sequences, each time a tile is stored and, with a
+    single process, each time a block of rows of a tile is done.
+    markov_order is the order of the background of the
+    d2* and d2S measures (see markov_background).
+
+    """
+    size = profiles.shape[0]
+    block_size = measure_block_size(profiles, corr, block_size)
+    if block_size is None or block_size <= 0:
+        #enough tiles of the lower triangle to keep 2*processes workers busy
+        blocks = 1
+        while processes > 1 and blocks * (blocks + 1) // 2 < 2 * processes and blocks < size:
+            blocks += 1
+        block_size = max(-(-size // blocks), 1)
+    edges = list(range(0, size, block_size)) + [size]
+    tiles = [((edges[i], edges[i+1]), (edges[j], edges[j+1]))
+             for i in range(0, len(edges) - 1) for j in range(0, i + 1)]
+
+    done = set()
+    if out_path is None:
+        matrix = np.zeros((3, size, size))
+    else:
+        log_path = out_path + ".tiles"
+        run = dict(run_info or {}, corr=corr, block_size=block_size, markov_order=markov_order,
+                   shape=list(profiles.shape), profiles=profiles_digest(profiles))
+        header = "# {}\n".format(json.dumps(run, sort_keys=True))
+        matrix = None
+        if resume and os.path.exists(out_path) and os.path.exists(log_path):
+            with open(log_path) as log:
+                lines = log.readlines()
+            if lines[:1] != [header]:
+                logging.getLogger("Kmer").warning(
+                    "%s was computed by a different run: it is computed again", out_path)
+            else:
+                matrix = np.lib.format.open_memmap(out_path, mode="r+")
+                if matrix.shape != (3, size, size):
+                    matrix = None
+                else:
+                    done.update(tuple(int(v) for v in line.split()) for line in lines[1:])
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float64,
+                                               shape=(3, size, size))
+            with open(log_path, "w") as log:
+                log.write(header)
+    tiles = [tile for tile in tiles if (tile[0][0], tile[1][0], block_size) not in done]
+
+    def pairs(tile, rows=None):
+        (row_start, row_end), (col_start, col_end) = tile
+        rows = row_end - row_start if rows is None else rows
+        if row_start == col_start:
+            return rows * (rows + 1) // 2
+        return rows * (col_end - col_start)
+
+    total = sum(pairs(tile) for tile in tiles)
+    stored = [0]
+
+    def store(tile, block):
+        (row_start, row_end), (col_start, col_end) = tile
+        matrix[:, row_start:row_end, col_start:col_end] = block
+        matrix[:, col_start:col_end, row_start:row_end] = block.transpose(0, 2, 1)
+        if out_path is not None:
+            matrix.flush()
+            with open(out_path + ".tiles", "a") as log:
+                log.write("{} {} {}\n".format(row_start, col_start, block_size))
+        if progress is not None:
+            stored[0] += pairs(tile)
+            progress(stored[0], total)
+
+    def tile_progress(tile, rows, tile_rows):
+        if rows < tile_rows:  #the whole tile is reported by store
+            progress(stored[0] + pairs(tile, rows), total)
+
+    compute_tiles(tiles, prepare_profiles(profiles, corr, markov_order), corr, store,
+                  processes=processes, progress=None if progress is None else tile_progress)
+    return matrix
+
+
+def output_matrix(size, out_path=None):
+    """It returns a zero (3, size, size) matrix laid out as corr_matrix,
+    in RAM or, if out_path is given, memory-mapped to a temporary file
+    next to out_path which replace_matrix moves there."""
+    if out_path is None:
+        return np.zeros((3, size, size))
+    return np.lib.format.open_memmap(out_path + ".{}.tmp".format(os.getpid()), mode="w+",
+                                     dtype=np.float64, shape=(3, size, size))
+
+
+def replace_matrix(matrix, out_path=None):
+    """It moves a matrix from output_matrix to out_path (which can be the
+    file of the matrix it replaces) and returns it memory-mapped; a
+    matrix in RAM is returned as it is."""
+    if out_path is None:
+        return matrix
+    matrix.flush()
+    tmp_path = matrix.filename
+    del matrix
+    os.replace(tmp_path, out_path)
+    return np.lib.format.open_memmap(out_path, mode="r+")
+
+
+def row_block(columns, values=2**24):
+    """It returns the number of rows of a (3, rows, columns) block of
+    about values values, to copy matrices by blocks of rows."""
+    return max(1, values // max(3*columns, 1))
+
+
+def write_metadata(path, metadata):
+    """It writes the metadata of a result file (names of the sequences,
+    k, correlation functions, ...) as JSON in path + ".json", next to
+    the memory-mappable *.npy file."""
+    with open(path + ".json", "w") as datafile_id:
+        json.dump(metadata, datafile_id, indent=1)
+
+
+def read_metadata(path):
+    """It reads the metadata written by write_metadata; an empty dict
+    is returned if there is none."""
+    if not os.path.exists(path + ".json"):
+        return {}
+    with open(path + ".json") as datafile_id:
+        return json.load(datafile_id)
+
+
+NEIGHBOUR_FIELDS = [("query", np.int64), ("rank", np.int64), ("reference", np.int64),
+                    ("correlation", np.float64)]
+
+
+def minhash_signatures(profiles, sketch_size=128, seed=0, block=2**16):
+    """It returns the MinHash sketches (one row of sketch_size uint64 per
+    sequence) of the sets of words observed in the profiles: each
+    column is the minimum of a different hash function over the indices
+    of the words. The fraction of equal columns of two sketches
+    estimates the Jaccard similarity of the two sets of words.
+
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 2**63, size=sketch_size, dtype=np.uint64) | np.uint64(1)
+    offsets = rng.integers(0, 2**63, size=sketch_size, dtype=np.uint64)
+    profiles = scipy.sparse.csr_matrix(profiles)
+    sketches = np.full((profiles.shape[0], sketch_size), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for row in range(0, profiles.shape[0]):
+        start, end = profiles.indptr[row], profiles.indptr[row+1]
+        words = profiles.indices[start:end][profiles.data[start:end] != 0].astype(np.uint64)
+        for first in range(0, len(words), block):
+            hashes = words[None, first:first+block] * multipliers[:, None] + offsets[:, None]
+            hashes ^= hashes >> np.uint64(31)  #the high bits of the product mixed into the low ones
+            sketches[row] = np.minimum(sketches[row], hashes.min(axis=1))
+    return sketches
+
+
+class ProfileIndex():
+
+    """An index of reference profiles answering "which references are
+    the most correlated with these queries" without the full matrix
+    of correlations. The references are prepared once: centred and
+    normalized for Pearson, ranked first for Spearman (see
+    rank_profiles), sorted once for Kendall (see tie_ranks). A batch of
+    queries then costs a single matrix product against the references
+    (Pearson, Spearman) or one tau per reference (Kendall).
+
+    With sketch_size, the MinHash sketches of the references are kept as
+    well (see minhash_signatures): a query can be compared exactly with
+    only the prefilter references sharing the most words with it, which
+    pays off for large k.
+
+    """
+
+    def __init__(self, profiles, corr="P", sketch_size=None, seed=0):
+        if corr not in ("P", "S", "T"):
+            raise ValueError("one correlation function (P, S or T) is needed, not {}".format(corr))
+        self.corr = corr
+        self.seed = seed
+        self.size, self.length = profiles.shape
+        self.sketches = None
+        if sketch_size:
+            self.sketches = minhash_signatures(profiles, sketch_size, seed)
+        self.references = self.prepare(profiles)
+
+    def prepare(self, profiles):
+        """It converts profiles (one row per sequence) into what the
+        chosen correlation function compares."""
+        if self.corr == "T":
+            return profile_ranks(profiles)
+        if self.corr == "S":
+            profiles = rank_profiles(profiles)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if scipy.sparse.issparse(profiles):
+                profiles = scipy.sparse.csr_matrix(profiles, dtype=np.float64)
+                sums = np.asarray(profiles.sum(axis=1)).ravel()
+                var = np.asarray(profiles.multiply(profiles).sum(axis=1)).ravel() - sums**2 / self.length
+                return profiles, sums, np.sqrt(var)
+            centred = np.asarray(profiles, dtype=np.float64)
+            centred = centred - centred.mean(axis=1, keepdims=True)
+            centred /= np.linalg.norm(centred, axis=1, keepdims=True)
+            return centred
+
+    def scores(self, queries, candidates=None):
+        """It returns the correlations between the prepared queries
+        (see prepare) and the references (only the ones in candidates,
+        if given): one row per query."""
+        if self.corr == "T":
+            if candidates is None:
+                candidates = range(0, self.size)
+            return np.array([[kendall_from_ranks(query, self.references[ref]) for ref in candidates]
+                             for query in queries]).reshape(len(queries), len(candidates))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if isinstance(self.references, tuple):
+                profiles, sums, scales = self.references
+                if candidates is not None:
+                    profiles, sums, scales = profiles[candidates], sums[candidates], scales[candidates]
+                query_profiles, query_sums, query_scales = queries
+                cov = (query_profiles @ profiles.T).toarray() - np.outer(query_sums, sums) / self.length
+                corr = cov / np.outer(query_scales, scales)
+            else:
+                references = self.references
+                if candidates is not None:
+                    references = references[candidates]
+                corr = queries @ references.T
+        return np.clip(corr, -1, 1)
+
+    def candidates(self, profiles, prefilter):
+        """It returns, for each query profile, the indices of the
+        prefilter references with the highest estimated Jaccard
+        similarity of their words (see minhash_signatures)."""
+        sketches = minhash_signatures(profiles, self.sketches.shape[1], self.seed)
+        prefilter = min(prefilter, self.size)
+        selected = []
+        for sketch in sketches:
+            similarity = (self.sketches == sketch).mean(axis=1)
+            selected.append(np.sort(np.argpartition(-similarity, prefilter - 1)[:prefilter]))
+        return selected
+
+    def query(self, profiles, top=10, prefilter=None):
+        """It returns the indices of the top most correlated references
+        of each query profile and the correlations, both as
+        (queries, top) arrays sorted by decreasing correlation (NaN
+        last). With prefilter (and sketches), only the prefilter most
+        similar references are correlated (see candidates).
+
+        """
+        top = min(top, self.size)
+        if prefilter is not None and self.sketches is not None and prefilter < self.size:
+            selected = self.candidates(profiles, max(prefilter, top))
+            rows = [self.scores(self.prepare(profiles[row:row+1]), cand)[0]
+                    for row, cand in enumerate(selected)]
+        else:
+            selected = None
+            rows = self.scores(self.prepare(profiles))
+        indices = np.zeros((len(rows), top), dtype=np.int64)
+        values = np.zeros((len(rows), top))
+        for row, corr in enumerate(rows):
+            order = np.where(np.isnan(corr), -np.inf, corr)
+            best = np.argpartition(-order, top - 1)[:top]
+            best = best[np.argsort(-order[best], kind="stable")]
+            values[row] = corr[best]
+            indices[row] = best if selected is None else selected[row][best]
+        return indices, values
+
+
+
+NO_STAGE = contextlib.nullcontext()
+
+
+class Instruments():
+
+    """The instrumentation of the Kmer pipeline: the timing of the
+    stages (the Kmer methods, see instrumented), counters (bases,
+    sequences, pairs correlated, bootstrap replicates, rejected
+    resamples, ...) and progress events. Each event is passed to the
+    callbacks as callback(event, stage, data), event being "start",
+    "end" (data has the seconds) or "progress" (data has done and
+    total); see log_event for a logging callback. If profile, a
+    cProfile profiler runs during the stages (see dump_profile).
+
+    When disabled (the default), a stage is a shared null context and
+    the counters are not updated, so the overhead is negligible.
+
+    """
+
+    def __init__(self, enabled=False, callbacks=None, profile=False):
+        self.enabled = enabled
+        self.callbacks = list(callbacks or [])
+        self.counters = collections.Counter()
+        self.timings = {}
+        self.profiler = None
+        self.depth = 0
+        if enabled:
+            self.enable(profile)
+
+    def enable(self, profile=False):
+        self.enabled = True
+        if profile and self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def stage(self, name, **info):
+        """A context manager timing the stage name."""
+        if not self.enabled:
+            return NO_STAGE
+        return self.timed_stage(name, info)
+
+    @contextlib.contextmanager
+    def timed_stage(self, name, info):
+        self.emit("start", name, info)
+        if self.profiler is not None and self.depth == 0:
+            self.profiler.enable()
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            self.depth -= 1
+            if self.profiler is not None and self.depth == 0:
+                self.profiler.disable()
+            calls, total = self.timings.get(name, (0, 0.))
+            self.timings[name] = (calls + 1, total + seconds)
+            self.emit("end", name, dict(info, seconds=seconds))
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def progress(self, name, done, total):
+        if self.enabled:
+            self.emit("progress", name, {"done": done, "total": total})
+
+    def emit(self, event, name, data):
+        for callback in self.callbacks:
+            callback(event, name, data)
+
+    def report(self):
+        """It returns the timing of each stage (calls, total and mean
+        seconds) and the counters as a text table."""
+        lines = ["{:<24}{:>8}{:>14}{:>14}".format("stage", "calls", "total [s]", "mean [s]")]
+        for name, (calls, total) in self.timings.items():
+            lines.append("{:<24}{:>8}{:>14.4f}{:>14.4f}".format(name, calls, total, total / calls))
+        for name, value in sorted(self.counters.items()):
+            lines.append("{:<24}{:>8}".format(name, value))
+        return "\n".join(lines)
+
+    def dump_profile(self, path):
+        """It saves the cProfile statistics (see pstats) in path."""
+        self.profiler.dump_stats(path)
+
+
+def log_event(event, stage, data):
+    """An Instruments callback logging the events on the "Kmer" logger."""
+    logger = logging.getLogger("Kmer")
+    if event == "progress":
+        logger.info("%s: %d/%d", stage, data["done"], data["total"])
+    elif event == "end":
+        logger.info("%s: done in %.3f s", stage, data["seconds"])
+    else:
+        logger.info("%s: started", stage)
+
+
+#the instrumentation used by the Kmer instances, unless they are given their own
+INSTRUMENTS = Instruments()
+
+
+def instrumented(method):
+    """It runs a Kmer method as a stage of its instruments."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.instruments.stage(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 
@@ -27,7 +1855,8 @@ class Kmer():
 
     """
 
-    def __init__(self, seqs=None, length_seqs=None, corrs=None, files=None):
+    def __init__(self, seqs=None, length_seqs=None, corrs=None, files=None, cache=None,
+                 canonical=False, instruments=None):
         """It initializes the main attributes of the class.
 
         Attributes
@@ -47,6 +1876,13 @@ class Kmer():
             - All (ALL)     <---- it correlates the sequences using the 
                                   three functions above. 
 
+            or one of the other similarity measures:
+
+            - Cosine (C)
+            - d2* (D2*), d2S (D2S)  <---- centred on a Markov background
+                                          of each sequence
+            - Jensen-Shannon (JS)   <---- 1 - the divergence in bits
+
             It can be decided a priori. If None, the script will ask for
             one.
             WARNING: the script will either calculate with one correlation
@@ -61,17 +1897,56 @@ class Kmer():
             file name.
         k: 'int'
             A parameter defining the length [bp] of an extracted "word".
-        all_w: 'list'
-            A list containing all the possible permutations given the 
-            alphabet and the words' lengths. In this case, 4**k.
+        all_w: 'numpy array'
+            An array containing all the possible permutations given the 
+            alphabet and the words' lengths. In this case, 4**k. The
+            words are only generated on demand (e.g. for labels).
         corr_matrix: 'numpy 3-D array'
             A 3-D array that contains the correlation values. It resembles
             an array of matrices: each matrix refers to a correlation
-            function.
-        ordered_kmers: '2D list'
-            A list containing a number of lists equal to the sequences' number.
-            Each list contains the occurrences of all the possible words for a
-            sequence. The occurrences of each list are sorted by all_w.
+            function. It can be memory-mapped (see correlations).
+        ordered_kmers: 'list'
+            A list containing a number of vectors (numpy int64 arrays) equal
+            to the sequences' number. Each vector contains the occurrences of
+            all the possible words for a sequence. The occurrences of each
+            vector are sorted by all_w. With the sparse backend (see
+            words_overlay) it is a scipy.sparse CSR matrix with one row
+            per sequence.
+        conf_int: 'numpy structured array'
+            The confidence intervals found by bootstrapping_BCa, one
+            record per pair of sequences (see CI_FIELDS).
+        binning: 'int'
+            The length of the subsequences (or windows) of the local
+            comparison, if any. The results are saved and loaded with
+            their metadata (see metadata, save_correlations).
+        markov_order: 'int'
+            The order of the Markov background of the d2* and d2S
+            measures, set by correlations (1 by default).
+        local_matrix: 'numpy 3-D array'
+            The correlations between the windows of two sequences found
+            by local_correlations, laid out as corr_matrix.
+        local_blocks, local_index: 'numpy arrays'
+            The blocks of window correlations of many pairs of sequences
+            found by local_scan and their index (see LOCAL_FIELDS).
+        cache: 'ProfileCache' or 'str'
+            An on-disk cache (or its directory) from which words_overlay
+            loads the profiles of the sequences already counted. If None,
+            no cache is used.
+        canonical: 'boolean'
+            If True, each word is counted together with its reverse
+            complement (canonical words, see kmer_indices): the profiles
+            do not depend on the strand of the sequences and are about
+            half as long. It applies to every words extraction
+            (optimal_k, words_overlay, sKmer, local comparisons) and so
+            to the correlations and the bootstrap.
+        index: 'ProfileIndex'
+            The index of the profiles built by build_index, queried by
+            nearest.
+        failures: 'dict'
+            The files skipped by stream_words, with the reason.
+        instruments: 'Instruments'
+            Timing, counters and progress of the stages. If None, the
+            module-wide INSTRUMENTS (disabled unless enabled) are used.
 
         """
         if seqs is None:
@@ -79,6 +1954,8 @@ class Kmer():
             self.length_seqs = []
         else:
             self.seqs = seqs
+            if length_seqs is None:
+                length_seqs = [len(seq) for seq in seqs]
             self.length_seqs = length_seqs
         self.alphabet = "ATCG"
         if corrs is None:
@@ -88,58 +1965,100 @@ class Kmer():
             self.corr = corrs
         if files is None:    
             self.files = []
+        else:
+            self.files = files
         self.k = 0
-        self.all_w = None
+        self._all_w = None
         self.corr_matrix = None
         self.ordered_kmers = None
+        self.conf_int = None
+        self.binning = None
+        self.markov_order = 1
+        self.local_matrix = None
+        self.local_blocks = None
+        self.local_index = None
+        if isinstance(cache, str):
+            cache = ProfileCache(cache)
+        self.cache = cache
+        self.canonical = canonical
+        self.index = None
+        self.failures = {}
+        self.instruments = INSTRUMENTS if instruments is None else instruments
+
+    @property
+    def all_w(self):
+        if self._all_w is None and self.k:
+            self._all_w = kmer_labels(self.word_indices(), self.k, self.alphabet)
+        return self._all_w
+
+    @all_w.setter
+    def all_w(self, words):
+        self._all_w = words
+
+    def word_indices(self):
+        """It returns the indices (see kmer_indices) of the words the
+        columns of the profiles refer to: all of them, or the canonical
+        ones in canonical mode."""
+        if self.canonical:
+            return canonical_words(self.k)
+        return np.arange(len(self.alphabet)**self.k)
+
+    def width(self):
+        """It returns the length of the profiles for the current k."""
+        return profile_width(self.k, len(self.alphabet), self.canonical)
+
+    def profile(self, index):
+        """It returns the words' occurrences of the sequence 'index'
+        as a dense vector sorted by all_w, whatever the backend of
+        ordered_kmers.
+
+        """
+        if scipy.sparse.issparse(self.ordered_kmers):
+            return self.ordered_kmers[index].toarray().ravel()
+        return np.asarray(self.ordered_kmers[index])
 
+    @instrumented
     def read_seqs(self, rel_path=None):
-        """It processes the Genbank (*.gb) and FASTA (*.fasta) files
-        to extract the sequences. 
+        """It processes the Genbank (*.gb, *.gbk) and FASTA (*.fasta, *.fa,
+        *.fna, *.fas) files, possibly gzip-compressed (*.gz), to extract the
+        sequences. The files are streamed record by record and each
+        sequence is stored 2-bit packed (see PackedSequence): the text form
+        is never kept in memory. Lower-case letters are upper-cased.
+
+        A file with several records gives several sequences, named
+        <file name>_<record id><extension> in files.
 
         WARNING: depending on which and how many features one has to
-        extract from *.gb files, the code must be changed accordingly.
+        extract from *.gb files, the code must be changed accordingly
+        (see read_genbank).
 
         """
         if rel_path is None:
             rel_path = input("Insert relative path: ")
-        if rel_path[0] == "/" or rel_path[0] == "\\":
-            rel_path = rel_path[1:]
-        if rel_path[-1] != "/":
-            rel_path = rel_path+"/" 
-        elif rel_path[-1] != "\\":
-            rel_path = rel_path+"\\"
-            
-        path = os.path.join(os.path.expanduser("~"), rel_path)
-        self.files = sorted(os.listdir(path))
+        path = os.path.join(os.path.expanduser("~"), rel_path.strip("/\\"))
         names_taken = []
-        for num, fil in enumerate(self.files):
-            if fil.endswith(".gb"):
-                rec = SeqIO.read(path+fil, "genbank")
-                for rec in SeqIO.parse(path+fil, "genbank"):
-                    for ff in rec.features:
-                        if ff.type == "source":  #this line select the genbank feature
-                            seq = ff.location.extract(rec).seq
-                            self.length_seqs.append(len(seq))
-                            self.seqs.append(seq)
-                            names_taken.append(fil)
-                            break   #in a *.gb file features can repeat (more studies on same region)
-            elif fil.endswith(".fasta"):
-                seq = ''.join(SeqIO.read(open(path+fil), "fasta").seq)
+        for fil in sorted(os.listdir(path)):
+            fmt = sequence_format(fil)
+            if fmt == "fasta":
+                records = list(read_fasta(os.path.join(path, fil), self.alphabet))
+            elif fmt == "genbank":
+                records = list(read_genbank(os.path.join(path, fil), self.alphabet))
+            else:
+                continue
+            for rec_id, seq in records:
                 self.length_seqs.append(len(seq))
-                if seq[0].islower():   #some fasta file can have lower-case character (by default
-                                       #they must be upper-case)
-                    seq = seq.upper()
                 self.seqs.append(seq)
-                names_taken.append(fil)
+                names_taken.append(record_name(fil, rec_id, len(records)))
+                self.instruments.count("bases_read", len(seq))
+            self.instruments.count("files_read")
 
-        self.files = [x for x in self.files if x in names_taken] # to have correspondence between
-                                                                 #name and its sequence
+        self.files = names_taken # to have correspondence between name and its sequence
 
 
 
 
-    def optimal_k(self, max_k=None):
+    @instrumented
+    def optimal_k(self, max_k=None, processes=1, canonical=None):
         """ Given a range of k values, the variety of the extracted
         words in a sequence changes. The method returns the (optimal)
         k(s) for which the variety (or richness) is maximum.
@@ -148,31 +2067,42 @@ class Kmer():
         'Alignment-free genome comparison with feature frequency 
         profiles (FFP) and optimal resolutions', (Gregory E. Sims,
         Se-Ran Jun, Guohong A. Wu and Sung-Hou Kima).
+
+        The whole richness curve of a sequence is computed in a single
+        pass (see kmer_richness).
+
+        Parameters
+        ----------
+        max_k: 'int'
+        The words' lengths 1, ..., max_k - 1 are tested.
+        processes: 'int'
+        Number of worker processes across which the sequences are
+        spread. With 1 everything runs in the current process.
+        canonical: 'boolean'
+        If given, it sets the canonical mode (see __init__).
         
         """
+        if canonical is not None:
+            self.canonical = canonical
         min_k = 1
         if max_k is None:
             max_k = 8
 
-        richness = np.zeros((len(self.seqs), max_k - 1))
+        encoded = [encode_sequence(seq, self.alphabet) for seq in self.seqs]
+        self.instruments.count("bases_scanned", sum(len(codes) for codes in encoded))
+        if processes > 1 and len(encoded) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+                richness = list(pool.map(kmer_richness, encoded,
+                                         itertools.repeat(max_k),
+                                         itertools.repeat(len(self.alphabet)),
+                                         itertools.repeat(self.canonical)))
+        else:
+            richness = [kmer_richness(codes, max_k, len(self.alphabet), self.canonical)
+                        for codes in encoded]
+        richness = np.array(richness).reshape(len(self.seqs), max_k - min_k)
         opt_k = {}
-        k = 0
-        for ind, seq in enumerate(self.seqs):
-            for k in range(min_k, max_k):
-                pos = 0
-                end_pos = len(seq) - k + 1
-                kmers = []
-                for pos in range(0, end_pos):
-                    sub = seq[pos:k+pos]
-                    if not all(w in self.alphabet for w in sub):
-                        continue
-                    else:
-                        kmers.append(str(sub))
-                counting = collections.Counter(kmers)
-                for values in counting.values():
-                    if values >= 2:
-                        richness[ind][k-1] += 1
-            opt_k["{}".format(self.files[ind])] = np.argmax(richness[ind]) + 1
+        for ind in range(0, len(self.seqs)):
+            opt_k["{}".format(self.files[ind])] = np.argmax(richness[ind]) + min_k
         
         print(opt_k)
 
@@ -181,7 +2111,8 @@ class Kmer():
 
 
 
-    def words_overlay(self, k=None):
+    @instrumented
+    def words_overlay(self, k=None, sparse=False, canonical=None, processes=1):
         """The method extracts the words from each sequence given
         the parameter k. If k is None, the function will print
         the average k for the sequences based on the relation:
@@ -193,7 +2124,26 @@ class Kmer():
         latter for more informations). Then the user can choose
         the k to use.
 
+        Parameters
+        ----------
+        k: 'int'
+        The words' length.
+        sparse: 'boolean'
+        If True, ordered_kmers is stored as a scipy.sparse CSR matrix
+        holding only the observed words: to be used for large k, where
+        4**k dense vectors per sequence do not fit in memory.
+        canonical: 'boolean'
+        If given, it sets the canonical mode (see __init__).
+        processes: 'int'
+        Number of worker processes across which the sequences are
+        counted (see ordered_results).
+
+        If the instance has a cache, the profiles already counted are
+        loaded from it and the new ones are stored in it.
+
         """
+        if canonical is not None:
+            self.canonical = canonical
         if k is not None:
             self.k = k
         else:
@@ -205,84 +2155,304 @@ class Kmer():
             print("Average k: ", average_k)
             self.k = int(input("Choose words' length: "))
 
-        self.all_w = np.empty(4**self.k, dtype=object)
-        for index, items in enumerate(itertools.product(self.alphabet, repeat=self.k)):
-            self.all_w[index] = ''.join(items)
+        self.all_w = None
 
         print("Extracting words... ")
-        #self.count_kmers = [] #[[] for lists in range(len(self.seqs))]
-        self.ordered_kmers = [[] for lists in range(len(self.seqs))]
-        #if not self.boot_switch:
-            #self.sample_size = [[] for lists in range(len(self.seqs))]
-        for index, sequence in enumerate(self.seqs):
-            pos = 0
-            end_pos = len(sequence) - self.k + 1
-            kmers = []
-            for pos in range(0, end_pos):
-                sub = sequence[pos:self.k+pos]
-                if not all(w in self.alphabet for w in sub):
-                    continue
-                else:
-                    kmers.append(str(sub))
-            unordered_dic_kmers = collections.Counter(kmers)
-            for key in self.all_w:
-                self.ordered_kmers[index].append(unordered_dic_kmers[key])
+        self.ordered_kmers = self.count_profiles(self.seqs, sparse, processes)
 
         print("Words analysis completed.\n")
 
+    def count_profiles(self, seqs, sparse=False, processes=1):
+        """It returns the words' occurrences of seqs for the current k,
+        as a list of vectors or, if sparse, as a CSR matrix, in processes
+        worker processes. With a cache, the profiles found there are
+        loaded and only the missing ones are counted (and stored). The
+        progress is reported after each sequence counted.
 
+        """
+        progress = None
+        if self.instruments.enabled:
+            self.instruments.count("sequences_counted", len(seqs))
+            self.instruments.count("bases_counted", sum(len(sequence) for sequence in seqs))
+            progress = functools.partial(self.instruments.progress, "count_profiles")
+        if self.cache is not None:
+            rows = self.cache.count(seqs, self.k, self.alphabet, self.binning, self.canonical, processes,
+                                    progress)
+            if sparse:
+                return stack_sparse_counts(rows, self.width())
+            profiles = []
+            for words, counts in rows:
+                profile = np.zeros(self.width(), dtype=np.int64)
+                profile[words.astype(np.int64)] = counts
+                profiles.append(profile)
+            return profiles
+        rows = []
+        for row in ordered_results(_count_task, [(sequence, self.k, self.alphabet, sparse, self.canonical)
+                                                 for sequence in seqs], processes):
+            rows.append(row)
+            if progress is not None:
+                progress(len(rows), len(seqs))
+        return stack_sparse_counts(rows, self.width()) if sparse else rows
+
+    @instrumented
+    def add_seqs(self, seqs, files, length_seqs=None, processes=1, out_path=None):
+        """It adds new sequences to an instance whose words were already
+        extracted: only the new profiles are counted and, if corr_matrix
+        exists, only the new rows/columns are correlated (see
+        update_correlations).
 
-    def correlations(self):
-        """It correlates N sequences among each other using the words 
-        occurrences. Given the symmetric nature of the corr. functions, only 
-        N((N-1)/2 + 1) values are calculated.
-        
-        """        
-        self.corr_matrix = [np.zeros((len(self.seqs), len(self.seqs))) for l in range(0, 3)]
-        x = 0
+        Parameters
+        ----------
+        seqs: 'list'
+        The new sequences.
+        files: 'list'
+        The names of the new sequences.
+        length_seqs: 'list'
+        The lengths of the new sequences. If None, they are computed.
+        processes: 'int'
+        Number of worker processes for the counting and the
+        correlations.
+        out_path: 'str'
+        If given, the extended corr_matrix is a memory-mapped *.npy
+        file stored there (see update_correlations).
+
+        """
+        if length_seqs is None:
+            length_seqs = [len(seq) for seq in seqs]
+        sparse = scipy.sparse.issparse(self.ordered_kmers)
+        new_profiles = self.count_profiles(seqs, sparse, processes)
+        if sparse:
+            self.ordered_kmers = scipy.sparse.vstack([self.ordered_kmers, new_profiles], format="csr")
+        else:
+            self.ordered_kmers = list(self.ordered_kmers) + new_profiles
+        self.seqs = list(self.seqs) + list(seqs)
+        self.files = list(self.files) + list(files)
+        self.length_seqs = list(self.length_seqs) + list(length_seqs)
+        self.conf_int = None
+        if self.corr_matrix is not None:
+            self.update_correlations(processes=processes, out_path=out_path)
+
+    def remove_seqs(self, names, out_path=None):
+        """It removes the sequences named in names (as in files) together
+        with their profiles and rows/columns of corr_matrix. The matrix is
+        copied by blocks of rows, into a memory-mapped *.npy file if
+        out_path is given (it can be the file of the current corr_matrix),
+        so that it can exceed the RAM.
+
+        """
+        keep = [ind for ind, name in enumerate(self.files) if name not in names]
+        if len(keep) == len(self.files):
+            return
+        if len(self.seqs) == len(self.files):
+            self.seqs = [self.seqs[ind] for ind in keep]
+        if len(self.length_seqs) == len(self.files):
+            self.length_seqs = [self.length_seqs[ind] for ind in keep]
+        if scipy.sparse.issparse(self.ordered_kmers):
+            self.ordered_kmers = self.ordered_kmers[keep]
+        elif self.ordered_kmers is not None:
+            self.ordered_kmers = [self.ordered_kmers[ind] for ind in keep]
+        if self.corr_matrix is not None:
+            matrix = output_matrix(len(keep), out_path)
+            rows = row_block(len(self.files))
+            for start in range(0, len(keep), rows):
+                matrix[:, start:start+rows] = self.corr_matrix[:, keep[start:start+rows]][:, :, keep]
+            self.corr_matrix = None  #the old file can be the one replaced
+            self.corr_matrix = replace_matrix(matrix, out_path)
+        self.files = [self.files[ind] for ind in keep]
+        self.conf_int = None
+
+    @instrumented
+    def update_correlations(self, processes=1, block_size=None, out_path=None):
+        """It extends corr_matrix, computed (or loaded from a file) for
+        the first M profiles, to all the profiles in ordered_kmers: only
+        the missing (N - M) rows/columns are correlated, against every
+        profile, instead of the whole N x N matrix. If out_path is given,
+        the extended matrix is a memory-mapped *.npy file stored there
+        (it can be the file of the current corr_matrix), so that it can
+        exceed the RAM.
+
+        """
+        old = 0 if self.corr_matrix is None else np.shape(self.corr_matrix)[1]
+        profiles = self.stacked_profiles()
+        total = profiles.shape[0]
+        if old == total:
+            return
         print("Calculating correlations...")
-        for x in range(0, len(self.seqs)):
-            y = 0
-            for y in range(0, len(self.seqs)):
-                if x >= y:
-                    if self.corr == "S":
-                        value = scipy.stats.spearmanr(self.ordered_kmers[x], self.ordered_kmers[y])[0]
-                        self.corr_matrix[len(self.corr) - 1][x][y] = value
-                    elif self.corr == "T":
-                        value = scipy.stats.kendalltau(self.ordered_kmers[x], self.ordered_kmers[y])[0]
-                        self.corr_matrix[len(self.corr) - 1][x][y] = value
-                    elif self.corr == "P":
-                        value = scipy.stats.pearsonr(self.ordered_kmers[x], self.ordered_kmers[y])[0]
-                        self.corr_matrix[len(self.corr) - 1][x][y] = value
-                    else:
-                        spearm = scipy.stats.spearmanr(self.ordered_kmers[x], self.ordered_kmers[y])[0]
-                        tau = scipy.stats.kendalltau(self.ordered_kmers[x], self.ordered_kmers[y])[0]
-                        pears = scipy.stats.pearsonr(self.ordered_kmers[x], self.ordered_kmers[y])[0]
-                        corr = [spearm, tau, pears]
-                        for index, corrs in enumerate(corr):
-                            self.corr_matrix[index][x][y] = corrs
-                else:
-                    break
+        matrix = output_matrix(total, out_path)
+        rows = row_block(old)
+        for start in range(0, old, rows):  #copied in blocks of rows, as it can be memory-mapped
+            end = min(start + rows, old)
+            matrix[:, start:end, :old] = self.corr_matrix[:, start:end]
+
+        def store(tile, block):
+            (row_start, row_end), cols = tile
+            matrix[:, row_start:row_end, :] = block
+            matrix[:, :, row_start:row_end] = block.transpose(0, 2, 1)
+
+        block_size = measure_block_size(profiles, self.corr, block_size)
+        compute_tiles(row_tiles(old, total, total, block_size, processes),
+                      prepare_profiles(profiles, self.corr, self.markov_order), self.corr, store,
+                      processes=processes)
+        self.corr_matrix = None  #the old file can be the one replaced
+        self.corr_matrix = replace_matrix(matrix, out_path)
+        self.instruments.count("pairs_correlated", (total - old) * (total + old - 1) // 2)
+        print("Done.\n")
+
+    @instrumented
+    def stream_words(self, rel_path=None, k=None, sparse=False, chunk_size=2**20, processes=1,
+                     out_path=None, max_pending=None):
+        """It extracts the words straight from the files, without loading
+        the sequences: the FASTA files are read in chunks of about
+        chunk_size bases and the counts are updated chunk by chunk (see
+        count_kmers_chunks), so the memory is bounded whatever the size
+        of the sequences (chromosomes, metagenomes...). GenBank files are
+        read one record at a time. The resulting ordered_kmers, files and
+        length_seqs are the same as read_seqs followed by words_overlay,
+        while seqs stays empty.
+
+        Each file is parsed and counted as a whole (see count_file), in a
+        pool of worker processes if processes > 1; the profiles are
+        collected in the sorted order of the files. A file that cannot
+        be read is skipped and reported in failures, the others go on.
+
+        Parameters
+        ----------
+        rel_path: 'str'
+        The directory with the files, relative to the home directory.
+        k: 'int'
+        The words' length.
+        sparse: 'boolean'
+        Sparse backend for ordered_kmers (see words_overlay).
+        chunk_size: 'int'
+        Number of bases read at a time.
+        processes: 'int'
+        Number of worker processes counting the files.
+        out_path: 'str'
+        If given, the (dense) profiles are written row by row into this
+        *.npy file, as the files are counted, and ordered_kmers is the
+        N x 4**k array memory-mapped from it (see RowWriter).
+        max_pending: 'int'
+        Maximum number of files counted but not yet collected (default
+        2*processes): it bounds the memory held by the profiles in
+        flight.
 
-        if self.corr == "ALL":
-            stop = len(self.corr_matrix)
+        """
+        if rel_path is None:
+            rel_path = input("Insert relative path: ")
+        if k is None:
+            k = int(input("Choose words' length: "))
+        if sparse and out_path is not None:
+            raise ValueError("out_path needs dense profiles")
+        self.k = k
+        self.all_w = None
+        path = os.path.join(os.path.expanduser("~"), rel_path.strip("/\\"))
+        self.seqs = []
+        self.length_seqs = []
+        self.files = []
+        self.failures = {}
+        profiles = [] if out_path is None else RowWriter(out_path, self.width())
+        print("Extracting words... ")
+        names = [fil for fil in sorted(os.listdir(path)) if sequence_format(fil) is not None]
+        tasks = [(os.path.join(path, fil), k, self.alphabet, sparse, self.canonical, chunk_size)
+                 for fil in names]
+        results = ordered_results(_count_file_task, tasks, processes, max_pending)
+        for done, (fil, (records, error)) in enumerate(zip(names, results)):
+            self.instruments.progress("stream_words", done + 1, len(names))
+            if error is not None:
+                self.failures[fil] = error
+                self.instruments.count("files_failed")
+                print("Skipped {}: {}".format(fil, error))
+                continue
+            for name, length, counts in records:
+                self.files.append(name)
+                self.length_seqs.append(length)
+                profiles.append(counts)
+                self.instruments.count("sequences_counted")
+                self.instruments.count("bases_counted", length)
+        if sparse:
+            self.ordered_kmers = stack_sparse_counts(profiles, self.width())
+        elif out_path is not None:
+            self.ordered_kmers = profiles.close()
         else:
-            stop = 1
-        for ind in range(0, stop):
-            self.corr_matrix[ind] = self.corr_matrix[ind] + self.corr_matrix[ind].T - np.diag(
-                self.corr_matrix[ind].diagonal())  #it fills the rest of the array (symmetry)
+            self.ordered_kmers = profiles
+        print("Words analysis completed.\n")
+
+    def n_profiles(self):
+        """The number of sequences in ordered_kmers."""
+        if scipy.sparse.issparse(self.ordered_kmers):
+            return self.ordered_kmers.shape[0]
+        return len(self.ordered_kmers)
+
+
 
+    def stacked_profiles(self):
+        """It returns ordered_kmers as a single 2-D float array with one
+        row per sequence (a scipy.sparse CSR matrix with the sparse
+        backend).
+
+        """
+        if scipy.sparse.issparse(self.ordered_kmers):
+            return scipy.sparse.csr_matrix(self.ordered_kmers, dtype=np.float64)
+        return np.vstack(self.ordered_kmers).astype(np.float64)
+
+    @instrumented
+    def correlations(self, processes=1, block_size=None, out_path=None, resume=True, markov_order=None):
+        """It correlates N sequences among each other using the words 
+        occurrences. Pearson and Spearman are computed as matrix products
+        on the stacked profiles (ranked once per sequence for Spearman).
+        Given the symmetric nature of the corr. functions, only the lower
+        triangle is calculated, each profile being sorted once for Kendall
+        (see tiled_correlations).
+
+        Parameters
+        ----------
+        processes: 'int'
+        Number of worker processes computing the tiles.
+        block_size: 'int'
+        Number of sequences per side of a tile. If None, the matrix is
+        split in enough tiles for the processes (a single tile with one
+        process).
+        out_path: 'str'
+        If given, corr_matrix is a memory-mapped *.npy file stored there,
+        so that it can exceed the RAM.
+        resume: 'boolean'
+        With out_path, it only computes the tiles missing from a
+        previous (interrupted) run.
+        markov_order: 'int'
+        Order of the Markov background fitted on each sequence by the
+        d2* and d2S measures (see markov_background). If given, it is
+        kept in markov_order for the later updates and local comparisons.
+        
+        """        
+        if markov_order is not None:
+            self.markov_order = markov_order
+        if self.corr in ("D2*", "D2S"):
+            check_markov_order(self.k, self.markov_order)
+        print("Calculating correlations...")
+        progress = None
+        if self.instruments.enabled:
+            progress = functools.partial(self.instruments.progress, "correlations")
+        self.corr_matrix = tiled_correlations(self.stacked_profiles(), self.corr,
+                                              block_size=block_size, processes=processes,
+                                              out_path=out_path, resume=resume, progress=progress,
+                                              markov_order=self.markov_order,
+                                              run_info={"k": self.k, "canonical": self.canonical,
+                                                        "files": list(self.files)})
+        self.instruments.count("pairs_correlated", self.n_profiles() * (self.n_profiles() - 1) // 2)
 
         print("Done.\n")
 
 
-    def bootstrapping_BCa(self, alpha=0.04549, tolerance=10, B=10, BCa=True):
+    @instrumented
+    def bootstrapping_BCa(self, alpha=0.04549, tolerance=10, B=10, BCa=True, seed=None,
+                          references=None, processes=1, out_path=None):
         """The method calculates confidence intervals for specific 
-        correlation values of a 'model' sequence against N - 1 sequences,
-        using bootstrapping and bootstrapping BCa. The parameters must be
-        set according to the experiment (type of sequences, statistical 
-        significance, computational power, etc.).
-        The confidence levels are saved in *.txt format.
+        correlation values of 'model' (reference) sequences against the
+        other sequences, using bootstrapping and bootstrapping BCa. The
+        parameters must be set according to the experiment (type of
+        sequences, statistical significance, computational power, etc.).
+        The confidence levels are returned as a structured array (see
+        CI_FIELDS) and saved upon request (see save_intervals).
 
         WARNING: the bootstrapping theory makes use of samples generated 
         from the original one. However, between two sequences the corr. 
@@ -307,130 +2477,247 @@ class Kmer():
         Number of bootstraps. Greater the value, stronger the statistics.
         BCa: 'boolean'
         A switch to either perform BCa or not.
+        seed: 'int' or 'numpy.random.Generator'
+        Seed of the random generator drawing the words, for reproducible
+        runs. Each pair gets its own stream, so the results do not depend
+        on the number of processes. If None, a fresh seed is used.
+        references: 'list' or 'str'
+        Indices of the model sequences. If None, only the first sequence
+        is the model; with "ALL" every pair of sequences is considered.
+        processes: 'int'
+        Number of worker processes across which the pairs are spread.
+        out_path: 'str'
+        Path of the output file, in the format given by its extension
+        (see save_intervals). If None, nothing is written.
 
         """
+        if any(name not in ("P", "S", "T") for ind, name in corr_layout(self.corr)):
+            raise ValueError("the bootstrap needs the correlation functions P, S, T or ALL, not {}".format(
+                self.corr))
         print("Number of bootstraps: ", B)
         print("New sample size`s tolerance: +/- ", tolerance, "occurences")
         CL = 1- alpha
         print("Confidence level: ", CL*100, "%")
 
-        theta_low, theta_up, corr_func = ([[] for l in range(0, 3)] for i in range(3))
-        print(theta_low)
-        z = scipy. stats.norm.ppf(alpha)
-        zop = scipy.stats.norm.ppf(CL)
-        x = 0
-        if self.corr == "ALL":
-            stop = 3 
-            #corr_values = [[] for l in range(0,3)]
+        if references is None:
+            references = [0]
+        if references == "ALL":
+            pairs = list(itertools.combinations(range(0, self.n_profiles()), 2))
+        else:
+            references = list(references)
+            models = set(references)
+            pairs = [(x, y) for x in references for y in range(0, self.n_profiles())
+                     if y != x and not (y in models and y < x)]
+        seeds = np.random.SeedSequence(
+            seed.integers(2**63) if isinstance(seed, np.random.Generator) else seed).spawn(len(pairs))
+        tasks = [(x, y, [self.corr_matrix[ind][x][y] for ind, name in corr_layout(self.corr)],
+                  self.corr, alpha, tolerance, B, BCa, pair_seed)
+                 for (x, y), pair_seed in zip(pairs, seeds)]
+
+        profiles = self.ordered_kmers
+        if not scipy.sparse.issparse(profiles):
+            profiles = np.vstack(profiles)
+        intervals = []
+
+        def collect(results):
+            for interval, counters in results:
+                intervals.append(interval)
+                self.instruments.progress("bootstrapping_BCa", len(intervals), len(tasks))
+                self.instruments.count("pairs_bootstrapped")
+                for name, value in counters.items():
+                    self.instruments.count(name, value)
+
+        if processes > 1 and len(tasks) > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=processes, initializer=_bootstrap_init,
+                    initargs=(profiles,)) as pool:
+                collect(pool.map(_bootstrap_pair, tasks))
         else:
-            stop = 1      #corr_values = []
-            theta_low[1], theta_up[1], corr_func[1] = ([mt.nan]*(len(self.seqs) - 1) for l in range(3))
-            theta_low[2], theta_up[2], corr_func[2] = ([mt.nan]*(len(self.seqs) - 1) for l in range(3))
-        for x in range(0, 1):
-            for y in range(1, len(self.seqs)):
-                corr_values = [[] for l in range(0, stop)]
-                n = 0
-                for n in range(0, B):
-                    N = 0
-                    M = 0
-                    new_size_N = 0
-                    new_size_M = 0
-
-                    
-                    low_tol_N = sum(self.ordered_kmers[x]) - tolerance
-                    up_tol_N = sum(self.ordered_kmers[x]) + tolerance
-                    low_tol_M = sum(self.ordered_kmers[y]) - tolerance
-                    up_tol_M = sum(self.ordered_kmers[y]) + tolerance
-		
-                    #the while loop forces the size within the tolerance level
-                    while (new_size_N <= low_tol_N  or new_size_N >= up_tol_N) and (
-                            new_size_M <= low_tol_M  or new_size_M >= up_tol_M):
-
-                        sample_keys = np.random.choice(self.all_w, len(self.all_w))
-                        values_N = []
-                        values_M = []
-
-                        for key in sample_keys:
-                            index = np.where(self.all_w == key)
-                            values_N.append(self.ordered_kmers[x][index[0][0]])
-                            values_M.append(self.ordered_kmers[y][index[0][0]])
-
-                        new_size_N = sum(values_N)
-                        new_size_M = sum(values_M)
-
-                    if self.corr == "S":
-                         corr_values[0].append(scipy.stats.spearmanr(values_N, values_M)[0])
-                    elif self.corr == "T":
-                        corr_values[0].append(scipy.stats.kendalltau(values_N, values_M)[0])
-                    elif self.corr == "P":
-                        corr_values[0].append(scipy.stats.pearsonr(values_N, values_M)[0])
-                    else:
-                        corr_values[0].append(scipy.stats.spearmanr(values_N, values_M)[0])
-                        corr_values[1].append(scipy.stats.kendalltau(values_N, values_M)[0])
-                        corr_values[2].append(scipy.stats.pearsonr(values_N, values_M)[0])
-
-
-                corr_values = [sorted(corr_values[h]) for h in range(0, stop)] #len(corr_values))]
-
-                if BCa is True:
-
-                    jack_theta = [[] for l in range(0, stop)]#len(corr_values))]
-                    jack_theta_average = [[] for l in range(0, stop)]#len(corr_values))]
-                    lower_alpha = []
-                    upper_alpha = []
-                    k = 0
-                    for k in range(0, stop):#len(corr_values)):
-                        count = 0
-                        j = 0
-                        for j in range(0, len(corr_values[k])): #It runs over the elements of a correlation function
-                            jack_theta[k].append(sum(l for l in corr_values[k] if l != corr_values[k][j]))
-                            if corr_values[k][j] < self.corr_matrix[k][x][y]:
-                                count += 1
-                                
-                        jack_theta[k] = [l / (len(jack_theta[k]) - 1) for l in jack_theta[k]]        
-                        jack_theta_average[k].append(sum(jack_theta[k]) / len(jack_theta[k]))
-                        accel = (sum(jack_theta_average[k] - l for l in jack_theta[k])**3)/6*((
-                            sum(jack_theta_average[k] - l for l in jack_theta[k])**2)**(3/2))
-                        z_zero = scipy.stats.norm.ppf(count/B)
-
-                        lower_alpha.append(int(scipy.stats.norm.cdf(z_zero + (z_zero + z)/
-                                                                    (1 - accel*(z_zero + z)))*B))
-                        upper_alpha.append(scipy.stats.norm.cdf(z_zero + (z_zero + zop)/
-                                                                (1 - accel*(z_zero + zop)))*B)
-                        if not upper_alpha[k][0].is_integer():
-                            upper_alpha[k] = int(upper_alpha[k] + 1)
-                        else: upper_alpha[k] = int(upper_alpha[k])
-
-                        theta_low[k].append(corr_values[k][lower_alpha[k] - 1])
-                        theta_up[k].append(corr_values[k][upper_alpha[k] - 1])
-                        corr_func[k].append(self.corr_matrix[k][x][y])
+            _bootstrap_init(profiles)
+            collect(_bootstrap_pair(task) for task in tasks)
+            _bootstrap_init(None)
 
-                else:
-                    lower_alpha = int(B*(1 - CL))
-                    upper_alpha = CL*B
-                    if not upper_alpha.is_integer():
-                        upper_alpha = int(upper_alpha + 1)
-                    else: 
-                        upper_alpha = int(upper_alpha)
-                    k = 0    
-                    for k in range(0, stop):#len(corr_values)):
-                        theta_low[k].append(corr_values[k][lower_alpha - 1])
-                        theta_up[k].append(corr_values[k][upper_alpha - 1])
-                        corr_func[k].append(self.corr_matrix[k][x][y])
-
-    
-
-        with open("Conf_int.txt", "wb+") as datafile_id:
-            data = np.array([theta_low[0], theta_up[0], corr_func[0],
-                             theta_low[1], theta_up[1], corr_func[1],
-                             theta_low[2], theta_up[2], corr_func[2]])
-            data = data.T
-            np.savetxt(datafile_id, data, fmt="%f", delimiter="    ", header="SpearCIlow,\
+        self.conf_int = np.zeros(len(pairs), dtype=CI_FIELDS)
+        for ind, (x, y) in enumerate(pairs):
+            self.conf_int[ind] = (x, y) + intervals[ind]
+
+        if out_path is not None:
+            self.save_intervals(out_path)
+
+        return self.conf_int
+
+
+    @instrumented
+    def build_index(self, corr=None, sketch_size=None, seed=0):
+        """It indexes the profiles in ordered_kmers as references for
+        nearest (see ProfileIndex). The correlation function is corr or
+        the one of the instance (Pearson if it is "ALL"). With
+        sketch_size, MinHash sketches are kept to prefilter the
+        references.
+
+        """
+        if corr is None:
+            corr = "P" if self.corr == "ALL" else self.corr
+        self.index = ProfileIndex(self.stacked_profiles(), corr, sketch_size, seed)
+        return self.index
+
+    @instrumented
+    def nearest(self, seqs, top=10, prefilter=None):
+        """It returns the top most correlated references (the indexed
+        sequences, see build_index) of each sequence in seqs, as a
+        structured array (see NEIGHBOUR_FIELDS) with one record per
+        query and rank. The queries are counted with the same k (and
+        mode) as the references; no N x N matrix is computed.
+
+        Parameters
+        ----------
+        seqs: 'list'
+        The query sequences.
+        top: 'int'
+        Number of references returned per query.
+        prefilter: 'int'
+        If the index has sketches, only the prefilter references sharing
+        the most words with a query are correlated with it.
+
+        """
+        if self.index is None:
+            self.build_index()
+        profiles = self.count_profiles(seqs, scipy.sparse.issparse(self.ordered_kmers))
+        if not scipy.sparse.issparse(profiles):
+            profiles = np.vstack(profiles).astype(np.float64)
+        indices, values = self.index.query(profiles, top, prefilter)
+        neighbours = np.zeros(indices.size, dtype=NEIGHBOUR_FIELDS)
+        neighbours["query"] = np.repeat(np.arange(indices.shape[0]), indices.shape[1])
+        neighbours["rank"] = np.tile(np.arange(indices.shape[1]), indices.shape[0])
+        neighbours["reference"] = indices.ravel()
+        neighbours["correlation"] = values.ravel()
+        return neighbours
+
+    def metadata(self):
+        """It returns the run metadata stored next to the saved results."""
+        return {"files": list(self.files), "k": int(self.k), "corr": self.corr,
+                "binning": self.binning, "alphabet": self.alphabet, "canonical": self.canonical,
+                "markov_order": self.markov_order}
+
+    def set_metadata(self, metadata):
+        """It restores the run metadata of saved results (see metadata)."""
+        self.files = list(metadata.get("files", self.files))
+        self.k = int(metadata.get("k", self.k))
+        self.corr = metadata.get("corr", self.corr)
+        self.binning = metadata.get("binning", self.binning)
+        self.canonical = metadata.get("canonical", self.canonical)
+        self.markov_order = int(metadata.get("markov_order", self.markov_order))
+        self._all_w = None
+
+    def save_profiles(self, path="profiles.npz"):
+        """It saves ordered_kmers in a *.npz file together with the run
+        metadata: the stacked profiles with the dense backend, the CSR
+        components with the sparse one.
+
+        """
+        profiles = self.ordered_kmers
+        metadata = np.array(json.dumps(self.metadata()))
+        if scipy.sparse.issparse(profiles):
+            profiles = scipy.sparse.csr_matrix(profiles)
+            np.savez(path, metadata=metadata, data=profiles.data, indices=profiles.indices,
+                     indptr=profiles.indptr, shape=profiles.shape)
+        else:
+            np.savez(path, metadata=metadata, profiles=np.vstack(profiles))
+
+    def load_profiles(self, path="profiles.npz"):
+        """It loads the profiles saved by save_profiles (or by the count
+        command) into ordered_kmers, with their metadata.
+
+        """
+        with np.load(path) as archive:
+            if "metadata" in archive:
+                self.set_metadata(json.loads(str(archive["metadata"])))
+            else:
+                self.set_metadata({"files": archive["files"].tolist(), "k": int(archive["k"])})
+            if "profiles" in archive:
+                self.ordered_kmers = list(archive["profiles"])
+            else:
+                self.ordered_kmers = scipy.sparse.csr_matrix(
+                    (archive["data"], archive["indices"], archive["indptr"]),
+                    shape=tuple(archive["shape"]))
+        return self.ordered_kmers
+
+    def save_correlations(self, path="corr_matrix.npy"):
+        """It saves corr_matrix as a *.npy file, which can be opened
+        memory-mapped without reading it all, and the run metadata in
+        path + ".json" (see write_metadata). If corr_matrix is already
+        memory-mapped to path (see correlations), only the metadata is
+        written.
+
+        """
+        matrix = self.corr_matrix
+        if isinstance(matrix, np.memmap) and matrix.filename is not None \
+                and os.path.abspath(matrix.filename) == os.path.abspath(path):
+            matrix.flush()
+        else:
+            np.save(path, matrix)
+        write_metadata(path, self.metadata())
+
+    def load_correlations(self, path="corr_matrix.npy", mmap_mode="r"):
+        """It loads a correlation matrix saved by save_correlations (or
+        by correlations with out_path) into corr_matrix, memory-mapped
+        unless mmap_mode is None, with its metadata.
+
+        """
+        self.set_metadata(read_metadata(path))
+        self.corr_matrix = np.load(path, mmap_mode=mmap_mode)
+        return self.corr_matrix
+
+    def save_intervals(self, path="Conf_int.npy"):
+        """It saves conf_int in the format given by the extension of
+        path: *.npy (structured array, with the metadata in
+        path + ".json"), *.parquet (it requires pyarrow; names of the
+        sequences and metadata included) or *.txt (the former text
+        table).
+
+        """
+        if path.endswith(".txt"):
+            with open(path, "wb+") as datafile_id:
+                data = np.array([self.conf_int[name] for name, kind in CI_FIELDS[2:]])
+                data = data.T
+                np.savetxt(datafile_id, data, fmt="%f", delimiter="    ", header="SpearCIlow,\
  SpearCIup, Spear, KenCIlow, KenCIup, Ken, PearCIL, PearCIup, Pear")
+        elif path.endswith(".parquet"):
+            import pyarrow
+            import pyarrow.parquet
+            columns = {name: self.conf_int[name] for name, kind in CI_FIELDS}
+            if self.files:
+                names = np.array(self.files)
+                columns["reference_name"] = names[self.conf_int["reference"]]
+                columns["sequence_name"] = names[self.conf_int["sequence"]]
+            table = pyarrow.table(columns)
+            table = table.replace_schema_metadata({"kmer": json.dumps(self.metadata())})
+            pyarrow.parquet.write_table(table, path)
+        else:
+            np.save(path, self.conf_int)
+            write_metadata(path, self.metadata())
+
+    def load_intervals(self, path="Conf_int.npy"):
+        """It loads the confidence intervals saved by save_intervals as
+        *.npy or *.parquet into conf_int, with their metadata.
+
+        """
+        if path.endswith(".parquet"):
+            import pyarrow.parquet
+            table = pyarrow.parquet.read_table(path)
+            self.set_metadata(json.loads(table.schema.metadata[b"kmer"]))
+            self.conf_int = np.zeros(table.num_rows, dtype=CI_FIELDS)
+            for name, kind in CI_FIELDS:
+                self.conf_int[name] = table.column(name).to_numpy()
+        else:
+            self.set_metadata(read_metadata(path))
+            self.conf_int = np.load(path)
+        return self.conf_int
 
 
 
 
+    @instrumented
     def sKmer(self, binning=100):
         """This method cut sequences in subsequences: it is used when
         the user wants to look for local changes in a sequence. The
@@ -442,6 +2729,10 @@ class Kmer():
         ----------
         binning: 'int'
         It defines the length of the subsequences.
+
+        WARNING: the words across the edges of two subsequences are lost
+        and only non-overlapping subsequences are possible: see
+        local_correlations for sliding windows.
         
         """
         self.binning = binning
@@ -456,154 +2747,438 @@ class Kmer():
                 i += 1
         self.seqs = subseqs
 
+    @instrumented
+    def local_correlations(self, x=0, y=1, window=100, stride=None, k=None, processes=1):
+        """It compares locally the sequence x with the sequence y, as
+        sKmer does, without cutting the sequences: the words of each
+        sequence are extracted once and the profiles of the windows of
+        window bp every stride bp (overlapping if stride < window) are
+        derived from them (see window_profiles). Only the X-windows
+        against Y-windows block is correlated. The result, a
+        (3, X windows, Y windows) array laid out as corr_matrix, is
+        stored in local_matrix and used by heatmap_sKmer.
 
+        Parameters
+        ----------
+        x, y: 'int'
+        Indices of the two sequences in seqs.
+        window: 'int'
+        Length [bp] of the windows.
+        stride: 'int'
+        Distance [bp] between the starts of two windows. If None, it is
+        equal to window (non-overlapping windows).
+        k: 'int'
+        The words' length. If None, the current k is used.
+        processes: 'int'
+        Number of worker processes.
 
+        """
+        if k is not None:
+            self.k = k
+        if self.corr in ("D2*", "D2S"):
+            check_markov_order(self.k, self.markov_order)
+        if stride is None:
+            stride = window
+        self.binning = window
+        self.stride = stride
+        profiles = [window_profiles(encode_sequence(self.seqs[ind], self.alphabet), self.k,
+                                    window, stride, len(self.alphabet), self.canonical)
+                    for ind in (x, y)]
+        self.limit = profiles[0].shape[0]
+        print("Calculating correlations...")
+        self.local_matrix = cross_correlations(profiles[0], profiles[1], self.corr, processes=processes,
+                                               markov_order=self.markov_order)
+        self.instruments.count("window_pairs_correlated", profiles[0].shape[0] * profiles[1].shape[0])
+        print("Done.\n")
+        return self.local_matrix
+
+    @instrumented
+    def local_scan(self, reference=0, queries=None, window=100, stride=None, k=None,
+                   processes=1):
+        """It compares locally (as local_correlations) a reference
+        sequence against many query sequences, e.g. a reference genome
+        against a panel of strains, in one job. The window profiles of
+        each sequence are computed once and only the reference-query
+        blocks are correlated, the pairs being spread across a process
+        pool (see pairwise_blocks).
+
+        The blocks are stored in local_blocks (flat buffer) and indexed by
+        local_index (one record per pair: x, y, offset, rows, cols); use
+        local_block(x, y) to get the (3, X windows, Y windows) block of
+        a pair.
 
-    def histogram(self):
-        """It saves/shows the words distribution for a sequence.
-        The words extraction must be performed before to call the
-        method.
+        Parameters
+        ----------
+        reference: 'int' or 'str'
+        Index in seqs of the reference sequence. With "ALL", every pair
+        of sequences is compared.
+        queries: 'list'
+        Indices of the query sequences. If None, all the sequences but
+        the reference.
+        window, stride, k, processes:
+        As in local_correlations.
 
         """
-        words = np.arange(4**self.k)
-        occurr = self.ordered_kmers
+        if k is not None:
+            self.k = k
+        if self.corr in ("D2*", "D2S"):
+            check_markov_order(self.k, self.markov_order)
+        if stride is None:
+            stride = window
+        self.binning = window
+        self.stride = stride
+        if reference == "ALL":
+            pairs = [(x, y) for x in range(0, len(self.seqs)) for y in range(x + 1, len(self.seqs))]
+        else:
+            if queries is None:
+                queries = [ind for ind in range(0, len(self.seqs)) if ind != reference]
+            pairs = [(reference, y) for y in queries]
+        profiles = {ind: window_profiles(encode_sequence(self.seqs[ind], self.alphabet), self.k,
+                                         window, stride, len(self.alphabet), self.canonical)
+                    for ind in sorted(set(itertools.chain.from_iterable(pairs)))}
+        print("Calculating correlations...")
+        self.local_blocks, self.local_index = pairwise_blocks(profiles, pairs, self.corr,
+                                                              processes=processes,
+                                                              markov_order=self.markov_order)
+        self.instruments.count("window_pairs_correlated",
+                               int((self.local_index["rows"] * self.local_index["cols"]).sum()))
+        print("Done.\n")
+        return self.local_index
+
+    def local_block(self, x, y):
+        """The (3, X windows, Y windows) block of the pair (x, y) found
+        by local_scan."""
+        for x_ind, y_ind, offset, rows, cols in self.local_index:
+            if (x_ind, y_ind) == (x, y):
+                return self.local_blocks[offset:offset + 3*rows*cols].reshape(3, rows, cols)
+            if (x_ind, y_ind) == (y, x):
+                return self.local_blocks[offset:offset + 3*rows*cols].reshape(
+                    3, rows, cols).transpose(0, 2, 1)
+        raise KeyError("pair ({}, {}) not compared".format(x, y))
+
 
-        for ind in range(0, len(occurr)):
 
-            occurr[ind] = [x / sum(occurr[ind]) for x in occurr[ind]]
-            plt.clf()
-            plt.bar(words, occurr[ind], align="center")
-            plt.xticks(words, self.all_w, rotation="vertical")
-            plt.title("Set title")
-            plt.xlabel("Words")
-            plt.ylabel("Frequencies")
-            plt.savefig("Namefile{}.png".format(ind), bbox_inches="tight")
-            #plt.close()
-            #plt.show()
+
+    @instrumented
+    def histogram(self, out_prefix="Namefile", top=None, prefix=None):
+        """It saves/shows the words distribution for a sequence.
+        The words extraction must be performed before to call the
+        method. The figures are saved as <out_prefix><index>.png.
+        Only the top most frequent words, or the words binned by their
+        first prefix letters, are drawn upon request (see
+        Kmer_plotting.histogram).
+
+        """
+        import Kmer_plotting
+        Kmer_plotting.histogram(self, out_prefix, top, prefix)
 
 
 
-    def heatmap(self, matrix=np.array([])):
+    @instrumented
+    def heatmap(self, matrix=None, kingdoms=None, out_prefix="Namefile", cluster=False,
+                max_pixels=2000):
         """It visualizes the matrix correlation values via heatmap.
         Each row represents a sequence as well as each column.
         The labels present the sequences' names and, upon request, 
-        can be coloured based on the kingdom a sequence belongs. 
-        For this, each file name must start with an integer number 
-        plus underscore as the following:
-
-        Integer     Kingdom
-        -------     -------
-        0_          Animalia
-        1_          Archaea
-        2_          Bacteria
-        3_          Fungi
-        4_          Plantae
-        5_          Protista
+        can be coloured based on the kingdom a sequence belongs
+        (see Kmer_plotting.heatmap). If kingdoms is None, the script
+        will ask for it. The figures are saved as
+        <out_prefix><index>.png. If cluster, the sequences are reordered
+        by hierarchical clustering; large matrices are drawn as an image
+        of at most max_pixels per side.
 
         """
-        if not matrix.any():
-            matrix = self.corr_matrix
-
-        king_switch = input("Do you want labels based on kingdoms? [y/n]: ")
-        labels = []
-        palettes = []
-        colors = ["red", "purple", "blue", "gray", "green", "orange",]
-                 #Animalia, Archaea, Bacteria, Fungi, Plantae, Protista
-
-        for files in self.files:
-            if king_switch == "y":
-                palettes.append(colors[int(files[0])])
-                files = files[2:]
-            if files.endswith(".gb"):
-                namefile = files.replace(".gb", "")
-                labels.append(namefile)
-            elif files.endswith(".fasta"):
-                namefile = files.replace(".fasta", "")
-                labels.append(namefile)
-
-
-        x = 0
-        if self.corr == "ALL":
-            stop = len(self.corr_matrix)
-            name_corr = ["Spearman", "Kendall", "Pearson"]
-        else:
-            stop = 1
-
-        for ind in range(0, stop):
-            plt.clf()
-            plt.figure()
-            points = sns.heatmap(self.corr_matrix[ind], square=True, vmin=-1, vmax=1,
-                                 xticklabels=labels, yticklabels=labels, cmap="RdBu_r", linewidths=.1,
-                                 cbar_kws={"ticks":[-1, -0.75, -0.5, -0.25, 0, 0.25, 0.5, 0.75, 1]}, fmt=".2f",
-                                 annot=False, annot_kws={"size": 9})
-            plt.xticks(rotation=90)
-            plt.yticks(rotation=0)
-            red_patch = mpatches.Patch(color="red", label="Animalia")
-            purple_patch = mpatches.Patch(color="purple", label="Archaea")
-            blue_patch = mpatches.Patch(color="blue", label="Bacteria")
-            gray_patch = mpatches.Patch(color="gray", label="Fungi")
-            green_patch = mpatches.Patch(color="green", label="Plantae")
-            orange_patch = mpatches.Patch(color="orange", label="Protista")
-            #plt.legend(handles = [red_patch, purple_patch, blue_patch], loc = 3, bbox_to_anchor = (-0.4, -0.3))
-            plt.tight_layout()
-            #plt.yticks(range(len(self.files)), labels)
-            if king_switch == "y":
-                for ind, label in enumerate(points.get_yticklabels()):
-                    label.set_color(palettes[::-1][ind])
-                for ind, label in enumerate(points.get_xticklabels()):
-                    label.set_color(palettes[ind])
-            plt.title("Set title")
-            plt.savefig("Namefile{}.png".format(ind), bbox_inches="tight")
-
-
-
-    def heatmap_sKmer(self):
+        import Kmer_plotting
+        Kmer_plotting.heatmap(self, matrix, kingdoms, out_prefix, cluster, max_pixels)
+
+
+
+    @instrumented
+    def heatmap_sKmer(self, pair=None, out_prefix="Namefile"):
         """ It visualizes the matrix correlation values via heatmap when
-        sKmer is applied. Each row represents the subsequences of a sequence Y
-        while each column represents the subsequences of a sequence X.
+        sKmer is applied (see Kmer_plotting.heatmap_sKmer). The figures
+        are saved as <out_prefix><index>.png.
 
         """
-        if self.corr == "ALL":
-            stop = len(self.corr_matrix)
-            name_corr = ["Spearman", "Kendall", "Pearson"]
-        else:
-            stop = 1
-            name_corr = [self.corr]
-        for ind in range(0, stop):
-            plt.clf()
-            fig = plt.figure()
-            ax = fig.add_subplot(111)
-            points = sns.heatmap(self.corr_matrix[ind][0:self.limit, self.limit:],
-                                 square=True, vmin=-1, vmax=1, cmap="RdBu_r", linewidths=.1,
-                                 cbar_kws={"ticks":[-1, -0.75, -0.5, -0.25, 0, 0.25, 0.5, 0.75, 1]},
-                                 fmt=".2f", annot=False, xticklabels=10, yticklabels=10,
-                                 annot_kws={"size": 9})
-            ax.plot([0, ax.get_ylim()[1]], [ax.get_ylim()[1], 0], ls="--", color=".3",
-                    linewidth=1.)
-
-            plt.title("sKmer - {} corr. for k = {} and bin = {} bp".format(
-                      name_corr[ind], self.k, self.binning))
-            plt.xlabel("Subsequences X [(x+1)*{} bp]".format(self.binning))
-            plt.ylabel("Subsequences Y [(y+1)*{} bp]".format(self.binning))
-            plt.savefig("Namefile{}.png".format(ind), bbox_inches="tight")
-            #plt.pause(0.001)
-            #plt.close()
+        import Kmer_plotting
+        Kmer_plotting.heatmap_sKmer(self, pair, out_prefix)
+
+
+
+def home_relative(path):
+    """read_seqs and stream_words take a path relative to the home
+    directory: it converts a path given on the command line (absolute
+    or relative to the working directory)."""
+    return os.path.relpath(os.path.abspath(os.path.expanduser(path)), os.path.expanduser("~"))
+
+
+def load_words(args, stream=True):
+    """It builds a Kmer instance and extracts the words as set by the
+    command line arguments; the profiles saved by the count command
+    (*.npz) are loaded instead."""
+    if args.input.endswith(".npz"):
+        quest = Kmer(corrs=getattr(args, "corr", "P"))
+        quest.load_profiles(args.input)
+        quest.corr = getattr(args, "corr", "P")
+        return quest
+    cache = None
+    if args.cache is not None:
+        cache = ProfileCache(args.cache, args.cache_size)
+    quest = Kmer(corrs=getattr(args, "corr", "P"), cache=cache, canonical=args.canonical)
+    if stream and args.stream:
+        quest.stream_words(home_relative(args.input), k=args.k, sparse=args.sparse,
+                           chunk_size=args.chunk_size, processes=args.processes,
+                           out_path=args.profiles_npy)
+    else:
+        quest.read_seqs(home_relative(args.input))
+        quest.words_overlay(args.k, sparse=args.sparse, processes=args.processes)
+    return quest
+
+
+def run_count(args):
+    quest = load_words(args)
+    quest.save_profiles(args.output)
+
+
+def run_optimal_k(args):
+    quest = Kmer(corrs="P", canonical=args.canonical)
+    quest.read_seqs(home_relative(args.input))
+    opt_k = quest.optimal_k(args.max_k, processes=args.processes)
+    with open(args.output, "w") as datafile_id:
+        json.dump({name: int(k) for name, k in opt_k.items()}, datafile_id, indent=1)
+
+
+def run_correlate(args):
+    quest = load_words(args)
+    quest.correlations(processes=args.processes, block_size=args.block_size,
+                       out_path=args.output, resume=args.resume, markov_order=args.markov_order)
+    quest.save_correlations(args.output)
+    if args.plot:
+        quest.heatmap(kingdoms=args.kingdoms, out_prefix=args.plot_prefix, cluster=args.cluster,
+                      max_pixels=args.max_pixels)
+
+
+def run_bootstrap(args):
+    quest = load_words(args)
+    quest.correlations(processes=args.processes, block_size=args.block_size)
+    references = args.references
+    if references != "ALL":
+        references = [int(ref) for ref in references.split(",")]
+    quest.bootstrapping_BCa(alpha=args.alpha, tolerance=args.tolerance, B=args.B, BCa=args.bca,
+                            seed=args.seed, references=references, processes=args.processes,
+                            out_path=args.output)
+
+
+def run_nearest(args):
+    if args.queries is None:
+        raise SystemExit("a directory of queries is required (--queries or config file)")
+    quest = load_words(args)
+    quest.build_index(sketch_size=args.sketch_size)
+    queries = Kmer(corrs=quest.corr)
+    queries.read_seqs(home_relative(args.queries))
+    neighbours = quest.nearest(queries.seqs, top=args.top, prefilter=args.prefilter)
+    with open(args.output, "w") as datafile_id:
+        datafile_id.write("query\trank\treference\tcorrelation\n")
+        for query, rank, reference, corr in neighbours.tolist():
+            datafile_id.write("{}\t{}\t{}\t{:f}\n".format(queries.files[query], rank + 1,
+                                                         quest.files[reference], corr))
+
+
+def run_skmer(args):
+    quest = Kmer(corrs=args.corr, canonical=args.canonical)
+    quest.markov_order = args.markov_order
+    quest.read_seqs(home_relative(args.input))
+    reference = args.reference if args.reference == "ALL" else int(args.reference)
+    queries = None
+    if args.queries is not None:
+        queries = [int(query) for query in args.queries.split(",")]
+    quest.local_scan(reference, queries, window=args.window, stride=args.stride, k=args.k,
+                     processes=args.processes)
+    np.savez(args.output, metadata=np.array(json.dumps(quest.metadata())),
+             blocks=quest.local_blocks, index=quest.local_index)
+    if args.plot:
+        for x, y in quest.local_index[["x", "y"]].tolist():
+            quest.heatmap_sKmer(pair=(x, y), out_prefix="{}{}_{}_".format(args.plot_prefix, x, y))
+
+
+def run_plot(args):
+    if args.kind == "histogram":
+        quest = load_words(args)
+        quest.histogram(out_prefix=args.plot_prefix, top=args.top, prefix=args.prefix)
+        return
+    if args.matrix is not None:
+        quest = Kmer(corrs=args.corr)
+        quest.load_correlations(args.matrix)
+    else:
+        quest = load_words(args)
+        quest.correlations(processes=args.processes, block_size=args.block_size,
+                           markov_order=args.markov_order)
+    quest.heatmap(kingdoms=args.kingdoms, out_prefix=args.plot_prefix, cluster=args.cluster,
+                  max_pixels=args.max_pixels)
+
+
+def build_parser():
+    """It returns the command line parser and its subcommand parsers."""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", help="JSON file with the default value of any option "
+                        "(keys as the option names, e.g. {\"k\": 6, \"corr\": \"S\"})")
+    common.add_argument("-p", "--processes", type=int, default=1,
+                        help="number of worker processes")
+    common.add_argument("--timings", action="store_true",
+                        help="print the time of each stage and the counters at the end")
+    common.add_argument("--progress", action="store_true",
+                        help="log the start, end and progress of the stages")
+    common.add_argument("--profile", help="save the cProfile statistics of the stages here")
+
+    words = argparse.ArgumentParser(add_help=False)
+    words.add_argument("-i", "--input",
+                       help="directory with the sequence files, or *.npz profiles saved by count")
+    words.add_argument("-k", type=int, help="words' length")
+    words.add_argument("--sparse", action="store_true", help="sparse profiles (large k)")
+    words.add_argument("--canonical", action="store_true",
+                       help="count each word together with its reverse complement")
+    words.add_argument("--stream", action="store_true",
+                       help="count the words while reading the files (bounded memory)")
+    words.add_argument("--chunk-size", type=int, default=2**20, help="bases read at a time with --stream")
+    words.add_argument("--profiles-npy",
+                       help="with --stream, write the profiles into this memory-mapped *.npy file")
+    words.add_argument("--cache", help="directory of the on-disk profile cache")
+    words.add_argument("--cache-size", type=int, default=2**30, help="cache size limit [bytes]")
+
+    corr = argparse.ArgumentParser(add_help=False)
+    corr.add_argument("--corr", choices=["P", "S", "T", "ALL", "C", "D2*", "D2S", "JS"], default="P",
+                      help="correlation function(s) or similarity measure")
+    corr.add_argument("--markov-order", type=int, default=1,
+                      help="order (0 to k - 2) of the Markov background of the D2* and D2S measures")
+    corr.add_argument("--block-size", type=int, help="sequences per side of a correlation tile")
+
+    plot = argparse.ArgumentParser(add_help=False)
+    plot.add_argument("--no-plot", dest="plot", action="store_false", help="do not draw figures")
+    plot.add_argument("--plot-prefix", default="Namefile", help="prefix of the figure files")
+    plot.add_argument("--kingdoms", action="store_true", help="colour the labels by kingdom")
+    plot.add_argument("--cluster", action="store_true", help="reorder the heatmap by clustering")
+    plot.add_argument("--max-pixels", type=int, default=2000,
+                      help="largest side of a heatmap drawn as an image")
+
+    parser = argparse.ArgumentParser(
+        prog="Kmer_algorithm.py",
+        description="Alignment-free comparison of genetic sequences through "
+                    "frequency feature profiles (FFP).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    subparsers = {}
+
+    sub = commands.add_parser("count", parents=[common, words], help="extract the words")
+    sub.add_argument("-o", "--output", default="profiles.npz", help="output *.npz file")
+    sub.set_defaults(func=run_count)
+    subparsers["count"] = sub
+
+    sub = commands.add_parser("optimal-k", parents=[common], help="find the optimal k(s)")
+    sub.add_argument("-i", "--input", help="directory with the sequence files")
+    sub.add_argument("--max-k", type=int, default=8, help="k from 1 to max_k - 1 are tested")
+    sub.add_argument("--canonical", action="store_true",
+                     help="count each word together with its reverse complement")
+    sub.add_argument("-o", "--output", default="optimal_k.json", help="output *.json file")
+    sub.set_defaults(func=run_optimal_k)
+    subparsers["optimal-k"] = sub
+
+    sub = commands.add_parser("correlate", parents=[common, words, corr, plot],
+                              help="correlate all the sequences")
+    sub.add_argument("-o", "--output", default="corr_matrix.npy",
+                     help="output (memory-mapped) *.npy file")
+    sub.add_argument("--resume", action="store_true",
+                     help="only compute the tiles missing from an interrupted run with the same output")
+    sub.set_defaults(func=run_correlate)
+    subparsers["correlate"] = sub
+
+    sub = commands.add_parser("bootstrap", parents=[common, words, corr],
+                              help="confidence intervals of the correlations")
+    sub.add_argument("-B", type=int, default=10, help="number of bootstraps")
+    sub.add_argument("--alpha", type=float, default=0.04549, help="significance level")
+    sub.add_argument("--tolerance", type=int, default=10, help="sample size tolerance")
+    sub.add_argument("--no-bca", dest="bca", action="store_false", help="plain percentile intervals")
+    sub.add_argument("--seed", type=int, help="random seed")
+    sub.add_argument("--references", default="0",
+                     help="comma-separated indices of the model sequences, or ALL")
+    sub.add_argument("-o", "--output", default="Conf_int.npy",
+                     help="output *.npy, *.parquet or *.txt file")
+    sub.set_defaults(func=run_bootstrap)
+    subparsers["bootstrap"] = sub
+
+    sub = commands.add_parser("nearest", parents=[common, words, corr],
+                              help="most correlated references of new sequences")
+    sub.add_argument("--queries", help="directory with the query sequence files")
+    sub.add_argument("--top", type=int, default=10, help="references returned per query")
+    sub.add_argument("--sketch-size", type=int, help="MinHash sketch size (prefilter)")
+    sub.add_argument("--prefilter", type=int,
+                     help="references correlated per query, chosen by sketch similarity")
+    sub.add_argument("-o", "--output", default="nearest.tsv", help="output *.tsv file")
+    sub.set_defaults(func=run_nearest)
+    subparsers["nearest"] = sub
+
+    sub = commands.add_parser("skmer", parents=[common, corr, plot],
+                              help="local comparison of a reference against other sequences")
+    sub.add_argument("-i", "--input", help="directory with the sequence files")
+    sub.add_argument("-k", type=int, help="words' length")
+    sub.add_argument("--canonical", action="store_true",
+                     help="count each word together with its reverse complement")
+    sub.add_argument("--window", type=int, default=100, help="window length [bp]")
+    sub.add_argument("--stride", type=int, help="distance between windows [bp] (default: window)")
+    sub.add_argument("--reference", default="0", help="index of the reference sequence, or ALL")
+    sub.add_argument("--queries", help="comma-separated indices of the queries (default: all)")
+    sub.add_argument("-o", "--output", default="local.npz", help="output *.npz file")
+    sub.set_defaults(func=run_skmer)
+    subparsers["skmer"] = sub
+
+    sub = commands.add_parser("plot", parents=[common, words, corr],
+                              help="draw heatmaps or histograms")
+    sub.add_argument("--kind", choices=["heatmap", "histogram"], default="heatmap")
+    sub.add_argument("--matrix", help="*.npy file written by correlate (default: recompute)")
+    sub.add_argument("--plot-prefix", default="Namefile", help="prefix of the figure files")
+    sub.add_argument("--kingdoms", action="store_true", help="colour the labels by kingdom")
+    sub.add_argument("--cluster", action="store_true", help="reorder the heatmap by clustering")
+    sub.add_argument("--max-pixels", type=int, default=2000,
+                     help="largest side of a heatmap drawn as an image")
+    sub.add_argument("--top", type=int, help="histogram of the top most frequent words only")
+    sub.add_argument("--prefix", type=int, help="histogram of the words binned by prefix")
+    sub.set_defaults(func=run_plot)
+    subparsers["plot"] = sub
+
+    return parser, subparsers
+
+
+def main(argv=None):
+    """Command line entry point: it never prompts, every choice comes
+    from the options or from a JSON config file (--config)."""
+    parser, subparsers = build_parser()
+    args = parser.parse_args(argv)
+    if args.config is not None:
+        with open(args.config) as datafile_id:
+            config = json.load(datafile_id)
+        subparsers[args.command].set_defaults(
+            **{key.replace("-", "_"): value for key, value in config.items()})
+        args = parser.parse_args(argv)
+    if getattr(args, "input", None) is None and getattr(args, "matrix", None) is None:
+        parser.error("an input directory is required (--input or config file)")
+    saved = str(args.input).endswith(".npz") or getattr(args, "matrix", None) is not None
+    if "k" in vars(args) and args.k is None and not saved:
+        parser.error("the words' length is required (-k or config file)")
+    if getattr(args, "corr", None) in ("D2*", "D2S") and getattr(args, "k", None) is not None:
+        try:
+            check_markov_order(args.k, args.markov_order)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.timings or args.progress or args.profile:
+        INSTRUMENTS.enable(profile=args.profile is not None)
+        if args.progress:
+            logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+            INSTRUMENTS.callbacks.append(log_event)
+    args.func(args)
+    if args.timings:
+        print(INSTRUMENTS.report())
+    if args.profile:
+        INSTRUMENTS.dump_profile(args.profile)
 
 
 
 if __name__ == "__main__":
-
-    quest = Kmer()
-    quest.read_seqs(rel_path="/relative/path/to/files")
-    decision = input("Do you want to perform sKmer? [y/n] ")
-    if decision == "y":
-        quest.sKmer()
-    quest.words_overlay()
-    quest.correlations()
-    if decision == "y":
-        quest.heatmap_sKmer()
-    else:
-    	quest.heatmap()    
-    #quest.bootstrapping_BCa()
-    
-                
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""Benchmarks of the Kmer pipeline (see Kmer_algorithm.py).
+
+The results are printed (or saved) as JSON, so that they can be
+compared across commits: with --baseline, the stages slower than a
+previous run by more than --max-slowdown are listed and the exit
+status is 1.
+
+The stages (counting, correlations, bootstrap, sKmer) run on synthetic
+genomes generated locally (see synthetic_genome), each in a fresh
+interpreter so that its peak RSS is its own.
+
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#fresh interpreters: the import time of the module and of a small counting job
+COLD_START = {
+    "import": "import Kmer_algorithm",
+    "count": "import Kmer_algorithm as K; K.count_kmers('ACGT' * 25000, 6)",
+}
+HEAVY_MODULES = ("matplotlib", "seaborn", "scipy.stats", "Bio")
+#collection sizes of the nearest neighbour benchmark
+QUERY_SIZES = (100, 1000, 4000)
+GENOME_KINDS = ("random", "repeats")
+
+
+def stage_suite(lengths, counts, ks, corr_n, corr_k, boot, skmer):
+    """It lists the stage parameters of a suite: the counting of counts
+    genomes of every length and k, the correlations of corr_n genomes
+    for each function, the bootstrap (N, B) and sKmer (length, window)."""
+    suite = []
+    for kind in GENOME_KINDS:
+        for length in lengths:
+            for n in counts:
+                for k in ks:
+                    suite.append({"stage": "count", "kind": kind, "length": length, "n": n,
+                                  "k": k, "sparse": 4**k > 2**20})
+        for corr in ("P", "S", "T"):
+            for n in corr_n:
+                suite.append({"stage": "correlate", "kind": kind, "length": lengths[0], "n": n,
+                              "k": corr_k, "corr": corr})
+        n, B = boot
+        suite.append({"stage": "bootstrap", "kind": kind, "length": lengths[0], "n": n,
+                      "k": corr_k, "corr": "ALL", "B": B})
+        length, window = skmer
+        suite.append({"stage": "skmer", "kind": kind, "length": length, "n": 2, "k": 3,
+                      "corr": "ALL", "window": window})
+    return suite
+
+
+#from 10 kb to 10 Mb, N from 10 to 5000, k from 3 to 12
+SUITES = {
+    "smoke": stage_suite(lengths=(10**4,), counts=(10,), ks=(3, 6), corr_n=(10,), corr_k=4,
+                         boot=(5, 20), skmer=(10**4, 500)),
+    "default": stage_suite(lengths=(10**5, 10**6), counts=(10, 100), ks=(3, 6, 9), corr_n=(100, 500),
+                           corr_k=6, boot=(20, 100), skmer=(10**6, 10**4)),
+    "full": stage_suite(lengths=(10**4, 10**6, 10**7), counts=(10, 100), ks=(3, 6, 9, 12),
+                        corr_n=(10, 1000, 5000), corr_k=6, boot=(50, 200), skmer=(10**7, 10**4)),
+}
+
+
+
+def synthetic_genome(length, kind, rng):
+    """It returns the codes (see Kmer_algorithm.encode_sequence) of a
+    random genome: uniform ("random"), or "repeats"-rich, with about
+    half of it made of mutated copies (5%) of a few interspersed repeat
+    families plus tandem repeats of short motifs.
+
+    """
+    import numpy as np
+    codes = rng.integers(0, 4, size=length, dtype=np.uint8)
+    if kind == "random":
+        return codes
+    families = [rng.integers(0, 4, size=int(rng.integers(300, 3000)), dtype=np.uint8)
+                for fam in range(0, 5)]
+    covered = 0
+    while covered < 0.4 * length:
+        family = families[int(rng.integers(0, len(families)))]
+        size = min(len(family), length)
+        start = int(rng.integers(0, length - size + 1))
+        copy = family[:size].copy()
+        mutated = rng.random(size) < 0.05
+        copy[mutated] = rng.integers(0, 4, size=int(mutated.sum()), dtype=np.uint8)
+        codes[start:start+size] = copy
+        covered += size
+    while covered < 0.5 * length:
+        motif = rng.integers(0, 4, size=int(rng.integers(2, 11)), dtype=np.uint8)
+        size = min(int(rng.integers(50, 500)), length)
+        start = int(rng.integers(0, length - size + 1))
+        codes[start:start+size] = np.resize(motif, size)
+        covered += size
+    return codes
+
+
+def peak_rss_mb():
+    """The peak resident set size [MB] of the current process (since the
+    last reset_peak_rss, on Linux)."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def rss_mb():
+    """The current resident set size [MB] of the process, or None if it
+    cannot be read (no /proc)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def reset_peak_rss():
+    """It resets the peak RSS of the process to the current RSS (Linux);
+    it returns False if the kernel does not allow it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+@contextlib.contextmanager
+def stage_peak_rss(result):
+    """It stores in result["peak_rss_mb"] the peak RSS [MB] reached
+    within the block: the high-water mark of the kernel is reset before
+    it or, if it cannot be, the RSS is sampled every 5 ms by a thread.
+    Without /proc, the peak of the whole process is reported."""
+    if reset_peak_rss() or rss_mb() is None:
+        yield
+        result["peak_rss_mb"] = peak_rss_mb()
+        return
+    samples = [rss_mb()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            samples.append(rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        done.set()
+        sampler.join()
+    samples.append(rss_mb())
+    result["peak_rss_mb"] = max(samples)
+
+
+def stage_name(params):
+    name = "{stage}_{kind}_L{length}_N{n}_k{k}".format(**params)
+    if params["stage"] in ("correlate", "bootstrap", "skmer"):
+        name += "_" + params["corr"]
+    return name
+
+
+def run_stage(params, repeat=1):
+    """It runs one stage of the pipeline on synthetic genomes (repeat
+    times) and returns its median wall time [s], the RSS [MB] after
+    the setup, the peak RSS [MB] within the stage (see stage_peak_rss)
+    and its throughput (bases/s for the counting,
+    pairs/s for the rest).
+
+    """
+    import numpy as np
+    import scipy.stats  #imported lazily by the module: not part of the stage
+    sys.path.insert(0, HERE)
+    import Kmer_algorithm
+
+    rng = np.random.default_rng(params.get("seed", 0))
+    seqs = [Kmer_algorithm.PackedSequence.from_codes(
+        synthetic_genome(params["length"], params["kind"], rng)) for ind in range(0, params["n"])]
+    quest = Kmer_algorithm.Kmer(seqs=seqs, corrs=params.get("corr", "P"),
+                                files=["genome{}".format(ind) for ind in range(0, params["n"])])
+    stage = params["stage"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage in ("correlate", "bootstrap"):
+            quest.words_overlay(params["k"])
+        if stage == "bootstrap":
+            quest.correlations()
+        result = {"setup_rss_mb": rss_mb() or peak_rss_mb()}
+        times = []
+        with stage_peak_rss(result):
+            for run in range(0, repeat):
+                start = time.perf_counter()
+                if stage == "count":
+                    quest.words_overlay(params["k"], sparse=params.get("sparse", False))
+                elif stage == "correlate":
+                    quest.correlations()
+                elif stage == "bootstrap":
+                    quest.bootstrapping_BCa(B=params["B"], seed=0, references=[0])
+                elif stage == "skmer":
+                    quest.local_correlations(0, 1, window=params["window"], k=params["k"])
+                times.append(time.perf_counter() - start)
+        wall = statistics.median(times)
+    result["wall_s"] = wall
+    n = params["n"]
+    if stage == "count":
+        result["bases_per_s"] = n * params["length"] / wall
+    elif stage == "correlate":
+        result["pairs_per_s"] = n * (n - 1) / 2 / wall
+    elif stage == "bootstrap":
+        result["pairs_per_s"] = (n - 1) / wall
+        result["replicates_per_s"] = (n - 1) * params["B"] / wall
+    elif stage == "skmer":
+        windows = quest.local_matrix.shape[1] * quest.local_matrix.shape[2]
+        result["pairs_per_s"] = windows / wall
+    return result
+
+
+def stages(suite="smoke", repeat=1):
+    """It runs each stage of the suite (see SUITES) in a fresh
+    interpreter and returns the results by stage name."""
+    results = {}
+    for params in SUITES[suite]:
+        code = "import json, Kmer_benchmark as B; print(json.dumps(B.run_stage({!r}, {})))".format(
+            params, repeat)
+        output = subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True,
+                                capture_output=True, text=True).stdout
+        results[stage_name(params)] = dict(params, **json.loads(output.splitlines()[-1]))
+    return results
+
+
+def regressions(results, baseline, max_slowdown=0.25, min_time=0.05):
+    """It returns the measures (wall times, latencies) of results that
+    are slower than the same measures of baseline by more than
+    max_slowdown (a fraction). The measures shorter than min_time [s]
+    in both runs are left out: they are dominated by noise."""
+    slower = []
+
+    def compare(current, previous, path):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            if isinstance(value, dict) and isinstance(previous[key], dict):
+                compare(value, previous[key], path + [key])
+            elif key in ("wall_s", "median_s", "query_ms") and previous[key] > 0 \
+                    and max(value, previous[key]) * (1e-3 if key == "query_ms" else 1) >= min_time \
+                    and value > previous[key] * (1 + max_slowdown):
+                slower.append({"measure": "/".join(path + [key]), "baseline": previous[key],
+                               "current": value})
+
+    compare(results, baseline, [])
+    return slower
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def cold_start(repeat=5):
+    """It measures the wall time [s] of the COLD_START snippets, each run
+    repeat times in a new interpreter, and lists the heavy modules
+    (plotting, statistics, parsing) loaded by a counting job.
+
+    """
+    results = {}
+    for name, code in COLD_START.items():
+        times = []
+        for run in range(0, repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True)
+            times.append(time.perf_counter() - start)
+        results[name] = {"median_s": statistics.median(times), "min_s": min(times)}
+    probe = ("import json, sys; {}; print(json.dumps([m for m in {} if m in sys.modules]))"
+             .format(COLD_START["count"], list(HEAVY_MODULES)))
+    loaded = subprocess.run([sys.executable, "-c", probe], cwd=HERE, check=True,
+                            capture_output=True, text=True).stdout
+    results["heavy_modules_loaded"] = json.loads(loaded)
+    return results
+
+
+def query_latency(sizes=QUERY_SIZES, k=6, queries=10, repeat=5, seed=0):
+    """It measures, for collections of random profiles of increasing
+    size, the time [s] to index them (see Kmer_algorithm.ProfileIndex)
+    and the latency [ms] per query of a batch of nearest neighbour
+    queries, for Pearson and Spearman.
+
+    """
+    import numpy as np
+    sys.path.insert(0, HERE)
+    import Kmer_algorithm
+
+    rng = np.random.default_rng(seed)
+    rates = rng.gamma(2., 4., size=4**k)
+    results = {}
+    for size in sizes:
+        profiles = rng.poisson(rates, size=(size, 4**k)).astype(np.float64)
+        batch = rng.poisson(rates, size=(queries, 4**k)).astype(np.float64)
+        for corr in ("P", "S"):
+            start = time.perf_counter()
+            index = Kmer_algorithm.ProfileIndex(profiles, corr)
+            build = time.perf_counter() - start
+            times = []
+            for run in range(0, repeat):
+                start = time.perf_counter()
+                index.query(batch, top=10)
+                times.append(time.perf_counter() - start)
+            results["{}_{}".format(corr, size)] = {
+                "build_s": build, "query_ms": 1e3 * statistics.median(times) / queries}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the Kmer pipeline.")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measure")
+    parser.add_argument("--query-sizes", type=int, nargs="+", default=list(QUERY_SIZES),
+                        help="collection sizes of the nearest neighbour benchmark")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="smoke",
+                        help="scales of the pipeline stages")
+    parser.add_argument("--baseline", help="*.json results of a previous run to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=0.25,
+                        help="tolerated slowdown with respect to the baseline (fraction)")
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="measures shorter than this [s] are not compared")
+    parser.add_argument("-o", "--output", help="output *.json file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    results = {"python": sys.version.split()[0], "commit": git_commit(), "suite": args.suite,
+               "cold_start": cold_start(args.repeat),
+               "query_latency": query_latency(args.query_sizes, repeat=args.repeat),
+               "stages": stages(args.suite, args.repeat)}
+    if args.baseline is not None:
+        with open(args.baseline) as datafile_id:
+            results["regressions"] = regressions(results, json.load(datafile_id), args.max_slowdown,
+                                                 args.min_time)
+    if args.output is None:
+        print(json.dumps(results, indent=1))
+    else:
+        with open(args.output, "w") as datafile_id:
+            json.dump(results, datafile_id, indent=1)
+    if results.get("regressions"):
+        for slower in results["regressions"]:
+            print("Regression: {measure} {baseline:.4g} -> {current:.4g}".format(**slower),
+                  file=sys.stderr)
+        sys.exit(1)
+
+
+
+if __name__ == "__main__":
+    main()
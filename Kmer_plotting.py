@@ -0,0 +1,255 @@
+"""Plotting for the Kmer class (see Kmer_algorithm.py).
+
+The module is imported only when a figure is drawn, so that the runs
+which only count words or correlate do not pay for the matplotlib and
+seaborn start-up. The non-interactive Agg backend is forced: the
+figures are saved to files and no display is needed.
+
+"""
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import matplotlib.patches as mpatches
+import numpy as np
+import seaborn as sns
+
+from Kmer_algorithm import MEASURES, kmer_labels, strip_extension
+
+#above these sizes the heatmaps are drawn as a single image (see draw_matrix)
+SEABORN_LIMIT = 150
+MAX_BARS = 256
+
+
+
+def cluster_order(matrix):
+    """It returns the order of the rows/columns of a correlation matrix
+    given by an average-linkage hierarchical clustering on the distance
+    1 - correlation, so that similar sequences are drawn close."""
+    import scipy.cluster.hierarchy
+    import scipy.spatial.distance
+    distance = 1 - np.nan_to_num(np.asarray(matrix, dtype=np.float64), nan=0.)
+    distance = (distance + distance.T) / 2
+    np.fill_diagonal(distance, 0)
+    condensed = scipy.spatial.distance.squareform(np.clip(distance, 0, 2), checks=False)
+    return scipy.cluster.hierarchy.leaves_list(scipy.cluster.hierarchy.linkage(condensed, "average"))
+
+
+def downsample(matrix, max_pixels):
+    """It averages the matrix over square blocks so that no side is
+    longer than max_pixels (NaN are ignored). The matrix is read one band
+    of rows at a time, so a memory-mapped one is never loaded at once."""
+    factor = -(-max(matrix.shape) // max_pixels)
+    if factor <= 1:
+        return np.asarray(matrix)
+    cols = -(-matrix.shape[1] // factor) * factor
+    image = np.empty((-(-matrix.shape[0] // factor), cols // factor))
+    band = np.empty((factor, cols))
+    for row in range(0, image.shape[0]):
+        values = matrix[row*factor:(row + 1)*factor]
+        band.fill(np.nan)
+        band[:len(values), :matrix.shape[1]] = values
+        with np.errstate(invalid="ignore"):
+            image[row] = np.nanmean(band.reshape(factor, cols // factor, factor), axis=(0, 2))
+    return image
+
+
+def draw_matrix(ax, matrix, max_pixels=2000):
+    """It draws a (large) correlation matrix as one rasterized image,
+    downsampled to at most max_pixels per side: the time does not
+    depend on the number of cells as for a seaborn heatmap."""
+    image = ax.imshow(downsample(matrix, max_pixels), cmap="RdBu_r", vmin=-1, vmax=1,
+                      interpolation="nearest", aspect="auto", rasterized=True,
+                      extent=(0, matrix.shape[1], matrix.shape[0], 0))
+    plt.colorbar(image, ax=ax, ticks=[-1, -0.75, -0.5, -0.25, 0, 0.25, 0.5, 0.75, 1])
+    return image
+
+
+def histogram(quest, out_prefix="Namefile", top=None, prefix=None):
+    """It saves/shows the words distribution for a sequence.
+    The words extraction must be performed before to call the
+    method. The figures are saved as <out_prefix><index>.png.
+    The profiles are normalized on copies: ordered_kmers is untouched.
+
+    Parameters
+    ----------
+    top: 'int'
+    Only the top most frequent words are drawn.
+    prefix: 'int'
+    The words are binned by their first prefix letters (4**prefix bars).
+
+    If neither is given, all the words are drawn when they are at most
+    MAX_BARS, otherwise the 50 most frequent ones.
+
+    """
+    if top is None and prefix is None and quest.width() > MAX_BARS:
+        top = 50
+
+    for ind in range(0, quest.n_profiles()):
+
+        occurr = quest.profile(ind).astype(np.float64)
+        occurr = occurr / occurr.sum()
+        if prefix is not None:
+            bins = quest.word_indices() // len(quest.alphabet)**(quest.k - prefix)
+            occurr = np.bincount(bins, weights=occurr, minlength=len(quest.alphabet)**prefix)
+            labels = kmer_labels(np.arange(len(occurr)), prefix, quest.alphabet)
+            xlabel = "Words (binned by the first {} letters)".format(prefix)
+        elif top is not None:
+            words = np.argsort(occurr, kind="stable")[::-1][:top]
+            occurr = occurr[words]
+            labels = kmer_labels(quest.word_indices()[words], quest.k, quest.alphabet)
+            xlabel = "Words (top {})".format(len(words))
+        else:
+            labels = quest.all_w
+            xlabel = "Words"
+        fig = plt.figure()
+        positions = np.arange(len(occurr))
+        plt.bar(positions, occurr, align="center")
+        plt.xticks(positions, labels, rotation="vertical")
+        plt.title("Set title")
+        plt.xlabel(xlabel)
+        plt.ylabel("Frequencies")
+        plt.savefig("{}{}.png".format(out_prefix, ind), bbox_inches="tight")
+        plt.close(fig)
+
+
+
+def heatmap(quest, matrix=None, kingdoms=None, out_prefix="Namefile", cluster=False,
+            max_pixels=2000):
+    """It visualizes the matrix correlation values via heatmap.
+    Each row represents a sequence as well as each column.
+    The labels present the sequences' names and, upon request, 
+    can be coloured based on the kingdom a sequence belongs. 
+    For this, each file name must start with an integer number 
+    plus underscore as the following:
+
+    Integer     Kingdom
+    -------     -------
+    0_          Animalia
+    1_          Archaea
+    2_          Bacteria
+    3_          Fungi
+    4_          Plantae
+    5_          Protista
+
+    If kingdoms is None, the script will ask for it. The figures are
+    saved as <out_prefix><index>.png.
+
+    With more than SEABORN_LIMIT sequences, the matrix is drawn as a
+    rasterized image downsampled to max_pixels per side (see
+    draw_matrix), without labels. If cluster, the sequences are
+    reordered by hierarchical clustering (see cluster_order).
+
+    """
+    if matrix is None or np.size(matrix) == 0:
+        matrix = quest.corr_matrix
+
+    if kingdoms is None:
+        king_switch = input("Do you want labels based on kingdoms? [y/n]: ")
+    else:
+        king_switch = "y" if kingdoms else "n"
+    labels = []
+    palettes = []
+    colors = ["red", "purple", "blue", "gray", "green", "orange",]
+             #Animalia, Archaea, Bacteria, Fungi, Plantae, Protista
+
+    for files in quest.files:
+        if king_switch == "y":
+            palettes.append(colors[int(files[0])])
+            files = files[2:]
+        labels.append(strip_extension(files))
+
+
+    x = 0
+    if quest.corr == "ALL":
+        stop = len(matrix)
+        name_corr = ["Spearman", "Kendall", "Pearson"]
+    else:
+        stop = 1
+
+    for ind in range(0, stop):
+        values = matrix[ind]
+        ticks_labels, ticks_palettes = labels, palettes
+        if cluster:
+            order = cluster_order(values)
+            values = np.asarray(values)[np.ix_(order, order)]
+            ticks_labels = [labels[num] for num in order]
+            ticks_palettes = [palettes[num] for num in order] if palettes else palettes
+        fig = plt.figure()
+        if len(values) > SEABORN_LIMIT:
+            draw_matrix(fig.add_subplot(111), values, max_pixels)
+            plt.title("Set title")
+            plt.savefig("{}{}.png".format(out_prefix, ind), bbox_inches="tight", dpi=200)
+            plt.close(fig)
+            continue
+        points = sns.heatmap(values, square=True, vmin=-1, vmax=1,
+                             xticklabels=ticks_labels, yticklabels=ticks_labels, cmap="RdBu_r", linewidths=.1,
+                             cbar_kws={"ticks":[-1, -0.75, -0.5, -0.25, 0, 0.25, 0.5, 0.75, 1]}, fmt=".2f",
+                             annot=False, annot_kws={"size": 9})
+        plt.xticks(rotation=90)
+        plt.yticks(rotation=0)
+        red_patch = mpatches.Patch(color="red", label="Animalia")
+        purple_patch = mpatches.Patch(color="purple", label="Archaea")
+        blue_patch = mpatches.Patch(color="blue", label="Bacteria")
+        gray_patch = mpatches.Patch(color="gray", label="Fungi")
+        green_patch = mpatches.Patch(color="green", label="Plantae")
+        orange_patch = mpatches.Patch(color="orange", label="Protista")
+        #plt.legend(handles = [red_patch, purple_patch, blue_patch], loc = 3, bbox_to_anchor = (-0.4, -0.3))
+        plt.tight_layout()
+        #plt.yticks(range(len(quest.files)), labels)
+        if king_switch == "y":
+            for num, label in enumerate(points.get_yticklabels()):
+                label.set_color(ticks_palettes[::-1][num])
+            for num, label in enumerate(points.get_xticklabels()):
+                label.set_color(ticks_palettes[num])
+        plt.title("Set title")
+        plt.savefig("{}{}.png".format(out_prefix, ind), bbox_inches="tight")
+        plt.close(fig)
+
+
+
+def heatmap_sKmer(quest, pair=None, out_prefix="Namefile"):
+    """ It visualizes the matrix correlation values via heatmap when
+    sKmer is applied. Each row represents the subsequences of a sequence Y
+    while each column represents the subsequences of a sequence X.
+    If local_correlations was called, its local_matrix is shown; the
+    block of a pair (x, y) compared by local_scan is shown if pair
+    is given. The figures are saved as <out_prefix><index>.png.
+    Blocks with more than SEABORN_LIMIT windows per side are drawn as a
+    rasterized image (see draw_matrix).
+
+    """
+    step = quest.binning
+    if pair is not None or quest.local_matrix is not None:
+        step = quest.stride
+    if quest.corr == "ALL":
+        stop = 3
+        name_corr = ["Spearman", "Kendall", "Pearson"]
+    else:
+        stop = 1
+        name_corr = [MEASURES.get(quest.corr, quest.corr)]
+    for ind in range(0, stop):
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+        if pair is not None:
+            block = quest.local_block(*pair)[ind]
+        elif quest.local_matrix is not None:
+            block = quest.local_matrix[ind]
+        else:
+            block = quest.corr_matrix[ind][0:quest.limit, quest.limit:]
+        if max(block.shape) > SEABORN_LIMIT:
+            draw_matrix(ax, block)
+        else:
+            points = sns.heatmap(block,
+                                 square=True, vmin=-1, vmax=1, cmap="RdBu_r", linewidths=.1,
+                                 cbar_kws={"ticks":[-1, -0.75, -0.5, -0.25, 0, 0.25, 0.5, 0.75, 1]},
+                                 fmt=".2f", annot=False, xticklabels=10, yticklabels=10,
+                                 annot_kws={"size": 9})
+        ax.plot([0, ax.get_ylim()[1]], [ax.get_ylim()[1], 0], ls="--", color=".3",
+                linewidth=1.)
+
+        plt.title("sKmer - {} corr. for k = {} and bin = {} bp".format(
+                  name_corr[ind], quest.k, quest.binning))
+        plt.xlabel("Subsequences X [(x+1)*{} bp]".format(step))
+        plt.ylabel("Subsequences Y [(y+1)*{} bp]".format(step))
+        plt.savefig("{}{}.png".format(out_prefix, ind), bbox_inches="tight")
+        plt.close(fig)